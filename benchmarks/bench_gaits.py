@@ -0,0 +1,226 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+# run from anywhere, the control code lives in the repo root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import gait_and_homing
+import i2c_comm
+import leg_scheduler
+from gait_and_homing import CompleteOneMovementCycle, JoystickToGait, HomeMotors, GetPlan
+from gaits import gaits
+from leg_emulator import makeEmulatedBus
+
+"""
+Benchmark of gait execution against emulated legs (leg_emulator.py).
+
+Runs every gait in gaits.gaits through CompleteOneMovementCycle, the d-pad/button paths through JoystickToGait, and a scripted HomeMotors pass. For each it reports cycles per second, bus transactions per cycle and wall time per step. Times are reported in robot seconds, i.e. wall time divided by --time-scale, so they are comparable between runs at different scales.
+
+Results are compared with a JSON baseline (benchmarks/baseline.json), the run fails if any case is slower or uses more bus transactions than the baseline by more than --threshold.
+
+    python benchmarks/bench_gaits.py                  # compare with baseline
+    python benchmarks/bench_gaits.py --save           # write a new baseline
+    python benchmarks/bench_gaits.py --action-time 3=1.0 --action-time 1=0.5
+"""
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# (name, x, y, coolness, lift_lower, send_to_home) inputs for JoystickToGait
+JOYSTICK_CASES = [
+    ("joystick_forward", 0, 1, False, False, False),
+    ("joystick_backward", 0, -1, False, False, False),
+    ("joystick_right", 1, 0, False, False, False),
+    ("joystick_left", -1, 0, False, False, False),
+    ("joystick_cool", 0, 0, True, False, False),
+    ("joystick_lift", 0, 0, False, True, False),
+    ("joystick_lower", 0, 0, False, True, False),
+    ("joystick_home", 0, 0, False, False, True),
+]
+
+# robot seconds per cycle below which timing differences are ignored
+NOISE_FLOOR = 0.05
+
+NEUTRAL = (0, 0, False, False, False, False, False)
+NUDGE_FORWARD = (1, 0, False, False, False, False, False)
+NEXT_LEG = (0, 0, False, True, False, False, False)
+
+
+class ScriptedJoystick:
+    def __init__(self, script):
+        """Stands in for GMTJoystick, each getPresses moves on to the next control tuple in script (then neutral) and reports its Y/B as presses"""
+
+        self.script = list(script)
+        self.controls = NEUTRAL
+
+    def getPresses(self):
+        self.controls = self.script.pop(0) if self.script else NEUTRAL
+
+        return [name for name, pressed in (("y", self.controls[3]), ("b", self.controls[4])) if pressed]
+
+    def getControls(self):
+        return self.controls
+
+
+@contextlib.contextmanager
+def scaledDelays(scale):
+    # Pi side sleeps are scaled with the emulated legs so the ratio between them stays the same as on the robot
+    patched = [
+        (i2c_comm, "POLL_INTERVAL"),
+        (leg_scheduler, "POLL_INTERVAL"),
+        (i2c_comm, "SEND_DELAY"),
+        (gait_and_homing, "STEP_SETTLE_TIME"),
+        (gait_and_homing, "HOMING_LOOP_DELAY"),
+    ]
+    saved = [(module, name, getattr(module, name)) for module, name in patched]
+
+    for module, name, value in saved:
+        setattr(module, name, value * scale)
+
+    try:
+        yield
+    finally:
+        for module, name, value in saved:
+            setattr(module, name, value)
+
+
+def measure(bus, run, cycles, steps, time_scale):
+    emulator = bus.bus
+    writes, reads = emulator.writes, emulator.reads
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(cycles):
+            run()
+    elapsed = (time.perf_counter() - start) / time_scale
+
+    transactions = emulator.writes - writes + emulator.reads - reads
+
+    return {
+        "cycles_per_sec": cycles / elapsed,
+        "transactions_per_cycle": transactions / cycles,
+        "step_time": elapsed / (cycles * steps),
+    }
+
+
+def runBenchmarks(time_scale, cycles, action_times=None, homing=True):
+    bus = makeEmulatedBus(time_scale=time_scale, action_times=action_times)
+    results = {}
+
+    with scaledDelays(time_scale):
+
+        for gait_id in sorted(gaits):
+            plan = GetPlan(bus, gait_id)
+            results[f"gait_{gait_id}"] = measure(bus, lambda: CompleteOneMovementCycle(plan, bus), cycles, len(plan), time_scale)
+
+        for name, x, y, coolness, lift_lower, send_to_home in JOYSTICK_CASES:
+            lift_state = gait_and_homing.LIFT_LOWER
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                steps = len(GetPlan(bus, gait_and_homing.SelectGait(x, y, coolness, lift_lower, send_to_home)))
+
+            def run():
+                # lift/lower toggles, start every cycle from the same state so each case stays one gait
+                gait_and_homing.LIFT_LOWER = lift_state
+                JoystickToGait(x, y, coolness, lift_lower, send_to_home, bus)
+
+            results[name] = measure(bus, run, cycles, steps, time_scale)
+
+        if homing:
+            # nudge each leg forward once then move on to the next one, the first entry is read when homing starts
+            script = [NEUTRAL] + [NUDGE_FORWARD, NEXT_LEG] * len(bus.devices)
+            joystick = ScriptedJoystick(script)
+            results["home_motors"] = measure(bus, lambda: HomeMotors(bus, joystick), 1, 2 * len(bus.devices), time_scale)
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Returns a list of regressions against the baseline results"""
+
+    regressions = []
+
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+
+        # compare cycle times, with a floor so gaits that finish instantly don't fail on timer noise
+        cycle_time = 1 / result["cycles_per_sec"]
+        base_cycle_time = 1 / base["cycles_per_sec"]
+
+        if cycle_time > base_cycle_time * (1 + threshold) + NOISE_FLOOR:
+            regressions.append(f"{name}: {result['cycles_per_sec']:.3f} cycles/s, baseline {base['cycles_per_sec']:.3f}")
+
+        if result["transactions_per_cycle"] > base["transactions_per_cycle"] * (1 + threshold):
+            regressions.append(f"{name}: {result['transactions_per_cycle']:.1f} transactions/cycle, baseline {base['transactions_per_cycle']:.1f}")
+
+    return regressions
+
+
+def parseActionTimes(values):
+    action_times = {}
+
+    for value in values:
+        action, seconds = value.split("=")
+        action_times[int(action)] = float(seconds)
+
+    return action_times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark gait execution against emulated legs")
+    parser.add_argument("--time-scale", type=float, default=0.1, help="emulated leg time per robot second")
+    parser.add_argument("--cycles", type=int, default=3, help="cycles per gait")
+    parser.add_argument("--action-time", action="append", default=[], metavar="ACTION=SECONDS", help="fixed duration for an action instead of the firmware timing model")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed regression as a fraction of the baseline")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--no-homing", action="store_true", help="skip the HomeMotors case")
+    args = parser.parse_args(argv)
+
+    action_times = parseActionTimes(args.action_time)
+    results = runBenchmarks(args.time_scale, args.cycles, action_times, homing=not args.no_homing)
+
+    print(f"{'case':<20} {'cycles/s':>10} {'trans/cycle':>12} {'s/step':>8}")
+    for name, result in results.items():
+        print(f"{name:<20} {result['cycles_per_sec']:>10.3f} {result['transactions_per_cycle']:>12.1f} {result['step_time']:>8.3f}")
+
+    config = {"time_scale": args.time_scale, "cycles": args.cycles, "action_times": action_times}
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump({"config": config, "results": results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save to create one")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    if baseline.get("config", {}).get("action_times", {}) != {str(k): v for k, v in action_times.items()}:
+        print("Warning: baseline was recorded with different --action-time settings")
+
+    regressions = compare(results, baseline["results"], args.threshold)
+
+    for regression in regressions:
+        print("REGRESSION", regression)
+
+    if regressions:
+        return 1
+
+    print(f"No regressions over {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
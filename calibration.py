@@ -0,0 +1,191 @@
+import json
+import os
+import time
+
+from i2c_comm import DeviceUnavailableError
+
+"""
+Per-leg calibration kept on the Pi, so a restart doesn't mean homing again.
+
+The hall encoders count from 0 at power on, so the encoder zero itself can't be stored. What is stored for each leg is its hip angle in the homed frame the last time it was known (after homing, once the robot is idle after gaits, and on shutdown), plus its hip limits. Only legs that report calibrated are stored, a leg that lost its zero has its entry removed. At startup RestoreCalibration checks each leg's status:
+
+- still calibrated (only the Pi restarted) - the leg's own zero is kept
+- not calibrated (the leg was power cycled) - a calibration frame (CMD_CALIBRATE) tells it that it is at the stored angle and sets its limits, then the status is read back to check it took
+
+Legs with no stored calibration, or whose read back disagrees (not calibrated, outside the limits, or sitting on the limit switch) are returned as needing homing. The store is then updated with the angles of the legs that agree. Needs the framed protocol.
+
+A pushed leg reports the angle it was just given, so its angle can't be checked against the store. Nothing but the limit switch is independent of the encoder, so a hip that was moved while its leg was powered off is only caught if it ended up outside the limits or on the switch. Press Y to home if a leg was moved by hand.
+
+CalibrationStore class - the JSON file, written through a temp file and os.replace so a crash never leaves it half written
+"""
+
+# default store, GMT_CALIBRATION overrides it
+CALIBRATION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "calibration.json")
+
+# hip limits in degrees when none are stored, same as MAX_ANGLE in leg_controller.ino
+DEFAULT_MIN_ANGLE = -25
+DEFAULT_MAX_ANGLE = 25
+
+# degrees a read back angle may be outside the stored limits
+ANGLE_TOLERANCE = 2.0
+
+# time for a leg to apply a calibration frame and refresh its status (STATUS_INTERVAL in the firmware is 10 ms)
+CALIBRATION_SETTLE = 0.05
+
+
+class CalibrationStore:
+    def __init__(self, path=None):
+
+        self.path = path or os.environ.get("GMT_CALIBRATION", CALIBRATION_PATH)
+
+        # hex address -> {"angle", "min_angle", "max_angle", "saved"}
+        self.legs = {}
+
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.legs = json.load(f)
+
+    def get(self, address):
+        return self.legs.get(hex(address))
+
+    def set(self, address, angle, min_angle=None, max_angle=None):
+        # limits default to what is already stored for the leg
+        entry = self.legs.get(hex(address), {})
+
+        self.legs[hex(address)] = {
+            "angle": round(float(angle), 1),
+            "min_angle": min_angle if min_angle is not None else entry.get("min_angle", DEFAULT_MIN_ANGLE),
+            "max_angle": max_angle if max_angle is not None else entry.get("max_angle", DEFAULT_MAX_ANGLE),
+            "saved": time.time(),
+        }
+
+    def forget(self, address):
+        self.legs.pop(hex(address), None)
+
+    def save(self):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+
+        with open(tmp, "w") as f:
+            json.dump(self.legs, f, indent=2, sort_keys=True)
+
+        os.replace(tmp, self.path)
+
+
+def CurrentAngles(bus, devices=None):
+    """
+    {address: hip angle} of the available legs, from telemetry when it is running, otherwise one batched status read
+    The angle is None for a leg whose encoder was never zeroed (not calibrated), its angle isn't in the homed frame
+    """
+
+    devices = bus.leg_order if devices is None else devices
+
+    if bus.telemetry is not None:
+        samples = {device.address: bus.telemetry.latest(device.address) for device in devices}
+        return {address: float(sample["angle"]) if sample["calibrated"] else None for address, sample in samples.items() if sample is not None}
+
+    return {address: status.angle if status.calibrated else None for address, status in bus.readStatuses(devices).items()}
+
+
+def SaveCalibration(bus, store, devices=None):
+    """
+    Store the current hip angle of each leg (default all), call after homing, when idle after gaits and on shutdown
+    A leg that isn't calibrated (failed or aborted homing, or gaits run without homing) has its entry removed instead, so a restart can't push an angle that doesn't match its hip
+    """
+
+    angles = CurrentAngles(bus, devices)
+
+    changed = False
+    for address, angle in angles.items():
+        entry = store.get(address)
+
+        if angle is None:
+            if entry is not None:
+                store.forget(address)
+                changed = True
+
+        elif entry is None or abs(entry["angle"] - angle) >= 0.1:
+            store.set(address, angle)
+            changed = True
+
+    if changed:
+        store.save()
+
+    return {address: angle for address, angle in angles.items() if angle is not None}
+
+
+def CheckCalibration(status, entry):
+    """Reason the leg's status disagrees with its stored calibration, None if it agrees"""
+
+    if not status.calibrated:
+        return "not calibrated"
+
+    if not entry["min_angle"] - ANGLE_TOLERANCE <= status.angle <= entry["max_angle"] + ANGLE_TOLERANCE:
+        return f"at {status.angle:.1f} deg, outside {entry['min_angle']}..{entry['max_angle']}"
+
+    if status.limit:
+        return "on the limit switch"
+
+    return None
+
+
+def RestoreCalibration(bus, store):
+    """
+    Push the stored calibration to every leg that lost it and check each leg against the store, returns the names of legs that need homing
+    """
+
+    if not bus.framed:
+        raise ValueError("Restoring calibration needs the framed protocol (I2CBus framed=True)")
+
+    needs_homing = []
+    pushed = []
+
+    stored = [device for device in bus.leg_order if store.get(device.address) is not None]
+    statuses = bus.readStatuses(stored)
+
+    for device in bus.leg_order:
+        entry = store.get(device.address)
+
+        if entry is None:
+            print(f"{device.name} has no stored calibration")
+            needs_homing.append(device.name)
+            continue
+
+        status = statuses.get(device.address)
+
+        if status is None:
+            print(f"{device.name} not responding")
+            needs_homing.append(device.name)
+            continue
+
+        # power cycled, tell it where it is
+        if not status.calibrated:
+            try:
+                device.sendCalibration(entry["angle"], entry["min_angle"], entry["max_angle"])
+                pushed.append(device)
+
+            except (OSError, DeviceUnavailableError) as e:
+                print(f"{device.name} not responding: {e}")
+                needs_homing.append(device.name)
+
+    if pushed:
+        time.sleep(CALIBRATION_SETTLE)
+
+    statuses = bus.readStatuses([device for device in bus.leg_order if device.name not in needs_homing])
+
+    for device in bus.leg_order:
+        if device.name in needs_homing:
+            continue
+
+        status = statuses.get(device.address)
+        reason = "no status" if status is None else CheckCalibration(status, store.get(device.address))
+
+        if reason is not None:
+            print(f"{device.name} calibration disagrees ({reason})")
+            needs_homing.append(device.name)
+
+    # legs that kept their own zero may have moved since the store was written
+    SaveCalibration(bus, store, [device for device in bus.leg_order if device.name not in needs_homing])
+
+    print(f"Restored calibration of {len(pushed)} legs, {len(needs_homing)} need homing")
+
+    return [device.name for device in bus.leg_order if device.name in needs_homing]
@@ -0,0 +1,86 @@
+import asyncio
+from collections import deque
+
+from metrics import METRICS
+
+"""
+Command queue between the joystick and the gait runner (control_loop.py).
+
+Two kinds of commands go through it:
+- direction commands (d-pad gaits) - a repeat of the last queued direction is collapsed into it, and a new direction drops every direction still queued, so the robot never walks off on stale input. While a direction is held it is repeated back-to-back whenever the queue is empty, so locomotion is continuous.
+- one-shot commands (button presses, by button name) - kept in order and never collapsed, a press is never lost.
+
+Coalesced and dropped commands are counted in metrics.METRICS.
+"""
+
+
+class CommandQueue:
+    def __init__(self):
+
+        # (command, is_direction) in arrival order
+        self.queue = deque()
+
+        # direction gait repeated while the d-pad is held, None when released
+        self.held = None
+
+        self.ready = asyncio.Event()
+
+    def pushDirection(self, gait_id):
+        # d-pad moved to a new direction
+        if self.queue and self.queue[-1] == (gait_id, True):
+            METRICS.count("commands_coalesced_total")
+            return
+
+        stale = [entry for entry in self.queue if entry[1]]
+        if stale:
+            METRICS.count("commands_dropped_total", amount=len(stale))
+            self.queue = deque(entry for entry in self.queue if not entry[1])
+
+        self.queue.append((gait_id, True))
+        self.ready.set()
+
+    def pushAction(self, command):
+        # button press, always runs
+        self.queue.append((command, False))
+        self.ready.set()
+
+    def setHeld(self, gait_id):
+        # direction currently held on the d-pad (None if released)
+        self.held = gait_id
+
+        if gait_id is not None:
+            self.ready.set()
+
+    def dropDirections(self):
+        # controller lost, stop walking, queued button presses still run
+        stale = [entry for entry in self.queue if entry[1]]
+        if stale:
+            METRICS.count("commands_dropped_total", amount=len(stale))
+            self.queue = deque(entry for entry in self.queue if not entry[1])
+
+        self.held = None
+
+    def clear(self):
+        self.queue.clear()
+        self.held = None
+        self.ready.clear()
+
+    def next(self):
+        """Next command to run, the held direction if nothing is queued, None if there is nothing to do"""
+
+        if self.queue:
+            command, _ = self.queue.popleft()
+            return command
+
+        return self.held
+
+    async def get(self):
+        # wait for the next command
+        while True:
+            command = self.next()
+
+            if command is not None:
+                return command
+
+            self.ready.clear()
+            await self.ready.wait()
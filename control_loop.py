@@ -0,0 +1,265 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import gait_and_homing
+from calibration import SaveCalibration
+from command_queue import CommandQueue
+from gait_and_homing import SelectGait, DirectionGait, HomeMotors, AutoHomeMotors, GetPlan
+from i2c_comm import I2CBus, Instruction, DeviceUnavailableError, POLL_INTERVAL, DONE_LINE_TIMEOUT
+from leg_scheduler import BuildSchedule, ScheduleFor, ScheduleRun, PollRunning
+from metrics import METRICS
+
+"""
+asyncio runtime for the main control loop. Three tasks run at the same time:
+
+input task - reads the joystick thread's latest snapshot every INPUT_INTERVAL and collects its queued button presses
+gait task - takes commands from a command_queue.CommandQueue and runs each gait as a coroutine, so new input is queued while a gait is running and a held d-pad repeats its gait back-to-back
+bus task - owns the I2C bus, every transaction runs on one worker thread so the event loop never blocks on I2C
+"""
+
+# seconds between joystick samples
+INPUT_INTERVAL = 0.01
+
+# seconds without a command after a gait before the hip angles are saved, so back-to-back gaits never wait on it
+CALIBRATION_IDLE = 2.0
+
+
+class BusWorker:
+    def __init__(self, bus: I2CBus):
+
+        self.bus = bus
+        self.requests = asyncio.Queue()
+
+        # single thread keeps transactions on the bus in order
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="i2c")
+
+    async def call(self, fn, *args):
+        # queue a blocking bus function, returns its result once the bus task has run it
+        future = asyncio.get_running_loop().create_future()
+        await self.requests.put((fn, args, future))
+
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            fn, args, future = await self.requests.get()
+
+            try:
+                result = await loop.run_in_executor(self.executor, fn, *args)
+
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+async def WaitFinishedAsync(bus_io: BusWorker):
+    """Wait for every leg to report done, only polling the ones still moving"""
+
+    bus = bus_io.bus
+    pending = list(bus.devices.values())
+
+    if bus.done_line is not None:
+        await bus_io.call(bus.done_line.waitForDone, DONE_LINE_TIMEOUT)
+
+    while pending:
+        pending = await bus_io.call(bus.pollPending, pending)
+
+        if pending:
+            await asyncio.sleep(POLL_INTERVAL)
+
+
+async def MoveLegsAsync(bus_io: BusWorker, inst, addresses=None):
+    """Awaitable MoveLegs, sends commands to the legs and waits until completion"""
+
+    fwd = Instruction(bus_io.bus, inst, addresses)
+    await bus_io.call(fwd.sendToLegs)
+    await WaitFinishedAsync(bus_io)
+
+
+async def RunScheduleAsync(bus_io: BusWorker, schedule):
+    """Awaitable RunSchedule, each leg starts its next action as soon as its dependencies finish"""
+
+    bus = bus_io.bus
+    run = ScheduleRun(schedule)
+
+    while not run.isDone():
+        addresses, actions = run.takeReady()
+
+        if addresses:
+            await bus_io.call(bus.dispatch, addresses, actions)
+
+        finished = await bus_io.call(PollRunning, bus, run)
+        run.markFinished(finished)
+
+        if not finished:
+            await asyncio.sleep(POLL_INTERVAL)
+
+
+async def CompleteOneMovementCycleAsync(gait_type, bus_io: BusWorker):
+    """Awaitable CompleteOneMovementCycle, runs every step of a gait from gaits.py"""
+
+    addresses = getattr(gait_type, "addresses", None)
+
+    if gait_and_homing.USE_LEG_SCHEDULER:
+        if addresses is None:
+            schedule = BuildSchedule(gait_type, bus_io.bus.leg_addresses)
+        else:
+            schedule = ScheduleFor(gait_type)
+
+        await RunScheduleAsync(bus_io, schedule)
+        print("Done with gait")
+        return
+
+    for inst in gait_type:
+        await MoveLegsAsync(bus_io, inst, addresses)
+        print("Done with current instruction")
+        await asyncio.sleep(gait_and_homing.STEP_SETTLE_TIME)
+
+
+class ControlLoop:
+    def __init__(self, bus: I2CBus, joystick, calibration=None):
+        """
+        calibration - optional calibration.CalibrationStore, updated with the hip angles after homing, once idle after gaits (CALIBRATION_IDLE) and on shutdown
+        """
+
+        self.bus_io = BusWorker(bus)
+        self.joystick = joystick
+        self.calibration = calibration
+
+        # hip angles have changed since the last save
+        self.calibration_dirty = False
+
+        # d-pad gaits and button presses waiting for the gait task
+        self.commands = CommandQueue()
+
+        # input sampling stops while manual homing reads the joystick itself
+        self.input_paused = False
+
+        # d-pad gait last seen by the input task, reset with the queue so a direction still held is queued again
+        self.direction = None
+
+    def clearCommands(self):
+        self.commands.clear()
+        self.direction = None
+
+    async def inputTask(self):
+        while True:
+
+            if not self.input_paused:
+                # constant time reads of the joystick thread's snapshot and press queue
+                controls = self.joystick.getControls()
+                presses = self.joystick.getPresses()
+
+                if controls is not None:
+                    # buttons are edge triggered, each press runs once
+                    for press in presses:
+                        self.commands.pushAction(press)
+
+                    # d-pad gait is queued when the direction changes and repeated while held
+                    held = DirectionGait(controls.x, controls.y)
+
+                    if held != self.direction:
+                        if held is not None:
+                            self.commands.pushDirection(held)
+
+                        self.commands.setHeld(held)
+                        self.direction = held
+
+                elif self.direction is not None or self.commands.held is not None:
+                    # controller disconnected, nothing is held any more
+                    self.commands.dropDirections()
+                    self.direction = None
+
+            await asyncio.sleep(INPUT_INTERVAL)
+
+    async def home(self):
+        # limit switch homing first, manual homing for whatever it couldn't do
+        legs = None
+        if gait_and_homing.AUTO_HOMING:
+            legs = await self.bus_io.call(AutoHomeMotors, self.bus_io.bus)
+
+            if not legs:
+                self.clearCommands()
+                return
+
+        print("Starting Manual Homing")
+
+        # homing is blocking and polls the joystick on its own
+        self.input_paused = True
+        try:
+            await self.bus_io.call(HomeMotors, self.bus_io.bus, self.joystick, legs)
+        finally:
+            # presses and d-pad moves during homing were meant for HomeMotors
+            self.joystick.getPresses()
+            self.clearCommands()
+            self.input_paused = False
+
+        print("Finished Manual Homing")
+
+    def storeCalibration(self):
+        # keep the stored hip angles current so a restart doesn't need homing, blocking
+        if self.calibration is None:
+            return
+
+        try:
+            SaveCalibration(self.bus_io.bus, self.calibration)
+            self.calibration_dirty = False
+        except (OSError, ValueError, DeviceUnavailableError) as e:
+            print(f"Couldn't save calibration: {e}")
+
+    async def saveCalibration(self):
+        await self.bus_io.call(self.storeCalibration)
+
+    async def gaitTask(self):
+
+        while True:
+            try:
+                # saved once nothing has been queued for a while instead of between gaits
+                command = await asyncio.wait_for(self.commands.get(), CALIBRATION_IDLE if self.calibration_dirty else None)
+            except asyncio.TimeoutError:
+                await self.saveCalibration()
+                continue
+
+            if command == "y":
+                await self.home()
+                await self.saveCalibration()
+                continue
+
+            if isinstance(command, str):
+                # button press, resolved now so the lift/lower toggle follows the order gaits actually ran in
+                gait_id = SelectGait(0, 0, command == "a", command == "x", command == "left_joy")
+            else:
+                gait_id = command
+
+            if gait_id is not None:
+                with METRICS.time("gait_cycle", gait=gait_id):
+                    await CompleteOneMovementCycleAsync(GetPlan(self.bus_io.bus, gait_id), self.bus_io)
+
+                self.calibration_dirty = self.calibration is not None
+
+    async def run(self):
+        try:
+            await asyncio.gather(self.inputTask(), self.gaitTask(), self.bus_io.run())
+        finally:
+            self.bus_io.close()
+
+
+def RunControlLoop(bus: I2CBus, joystick, calibration=None):
+    """Run the input, gait and bus tasks until interrupted, the hip angles are saved on the way out"""
+
+    control = ControlLoop(bus, joystick, calibration)
+
+    try:
+        asyncio.run(control.run())
+    finally:
+        if control.calibration_dirty:
+            control.storeCalibration()
@@ -0,0 +1,148 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+"""
+Structured event log for the bus hot path, used instead of print() in i2c_comm.py.
+
+Events are written into a preallocated ring buffer (time, level, event name, fields) and a background thread flushes them as one compact JSON object per line. Events below the log level return straight away, so polling loops cost almost nothing when verbose logging is off. If the flusher falls behind, the oldest events are overwritten and counted as dropped.
+
+The level is read from the GMT_LOG_LEVEL environment variable (debug, info, warning, error), default info.
+"""
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+LEVEL_NAMES = {DEBUG: "D", INFO: "I", WARNING: "W", ERROR: "E"}
+
+
+class EventLog:
+    def __init__(self, capacity=4096, level=INFO, stream=None, flush_interval=0.25):
+
+        self.capacity = capacity
+        self.level = level
+        self.stream = stream
+        self.flush_interval = flush_interval
+
+        # ring buffer, slot i % capacity holds event number i
+        self.times = [0.0] * capacity
+        self.levels = [0] * capacity
+        self.events = [None] * capacity
+        self.fields = [None] * capacity
+
+        # head is the next event number to write, tail the next to flush
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.flusher = None
+
+    def isEnabled(self, level):
+        return level >= self.level
+
+    def log(self, level, event, **fields):
+        if level < self.level:
+            return
+
+        with self.lock:
+            # overwrite the oldest event if the flusher hasn't caught up
+            if self.head - self.tail >= self.capacity:
+                self.tail += 1
+                self.dropped += 1
+
+            i = self.head % self.capacity
+            self.times[i] = time.time()
+            self.levels[i] = level
+            self.events[i] = event
+            self.fields[i] = fields
+            self.head += 1
+
+        if self.flusher is None:
+            self.startFlusher()
+
+        # get errors out straight away
+        if level >= ERROR:
+            self.wakeup.set()
+
+    def debug(self, event, **fields):
+        self.log(DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(ERROR, event, **fields)
+
+    def startFlusher(self):
+        with self.lock:
+            if self.flusher is not None:
+                return
+
+            self.flusher = threading.Thread(target=self.flushLoop, name="event-log", daemon=True)
+            self.flusher.start()
+
+    def flushLoop(self):
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def drain(self):
+        # copy pending events out of the ring buffer
+        with self.lock:
+            records = []
+
+            for n in range(self.tail, self.head):
+                i = n % self.capacity
+                records.append((self.times[i], self.levels[i], self.events[i], self.fields[i]))
+                self.fields[i] = None
+
+            self.tail = self.head
+            dropped = self.dropped
+            self.dropped = 0
+
+        return records, dropped
+
+    def flush(self):
+        records, dropped = self.drain()
+
+        if not records and not dropped:
+            return
+
+        lines = []
+
+        if dropped:
+            lines.append(self.format(time.time(), WARNING, "log_dropped", {"count": dropped}))
+
+        for t, level, event, fields in records:
+            lines.append(self.format(t, level, event, fields))
+
+        stream = self.stream if self.stream is not None else sys.stdout
+        stream.write("\n".join(lines) + "\n")
+        stream.flush()
+
+    def format(self, t, level, event, fields):
+        record = {"t": round(t, 4), "lvl": LEVEL_NAMES.get(level, level), "ev": event}
+        record.update(fields)
+
+        return json.dumps(record, separators=(",", ":"), default=str)
+
+
+def levelFromEnv(default=INFO):
+    return LEVELS.get(os.environ.get("GMT_LOG_LEVEL", "").lower(), default)
+
+
+# shared log for the control stack
+LOG = EventLog(level=levelFromEnv())
+atexit.register(LOG.flush)
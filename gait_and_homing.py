@@ -1,6 +1,10 @@
-from i2c_comm import I2CBus, Instruction
-from gaits import GAIT_SEND_TO_HOME, gaits, ACTION_ZERO, GAIT_LOWER_ALL, GAIT_RAISE_ALL, GAIT_SWIM_FORWARD, GAIT_SWIM_BACKWARD, ACTION_HOME_FORWARD, ACTION_HOME_BACKWARD, GAIT_COOL, ACTION_UP, ACTION_DOWN
+import i2c_comm
+from i2c_comm import I2CBus, Instruction, DeviceUnavailableError
+from gaits import GAIT_SEND_TO_HOME, GAIT_AUTO_HOME, gaits, ACTION_ZERO, GAIT_LOWER_ALL, GAIT_RAISE_ALL, GAIT_SWIM_FORWARD, GAIT_SWIM_BACKWARD, ACTION_HOME_FORWARD, ACTION_HOME_BACKWARD, GAIT_COOL, ACTION_UP, ACTION_DOWN
 from gaits import GAIT_SWIM_TURN_RIGHT, GAIT_SWIM_TURN_LEFT
+from gait_plans import compileGaits
+from leg_scheduler import BuildSchedule, RunSchedule, ScheduleFor
+from metrics import METRICS
 import time
 
 """
@@ -10,10 +14,44 @@ Functions to handle the joystick to gait conversion and testing single legs.
 # global for lifting and lowering
 LIFT_LOWER = False
 
-def MoveLegs(bus: I2CBus, inst):
+# pause after each step of a gait before sending the next one
+STEP_SETTLE_TIME = 0.6
+
+# wait between checks of the joystick while manually homing
+HOMING_LOOP_DELAY = 0.1
+
+# home on the limit switches first (AutoHomeMotors), manual homing only for the legs that fail
+AUTO_HOMING = True
+
+# run gaits per leg (leg_scheduler.py) instead of waiting for all legs after every step
+USE_LEG_SCHEDULER = True
+
+# what SelectGait prints for each d-pad gait
+DIRECTION_NAMES = {
+    GAIT_SWIM_TURN_RIGHT: "Turn right",
+    GAIT_SWIM_TURN_LEFT: "Turn Left",
+    GAIT_SWIM_FORWARD: "Forward",
+    GAIT_SWIM_BACKWARD: "Back",
+}
+
+def CompileGaits(bus: I2CBus):
+    """Validate every gait in gaits.py and compile it for the legs on the bus, raises ValueError on a bad table"""
+    
+    bus.plans = compileGaits(gaits, bus.leg_addresses)
+    return bus.plans
+
+def GetPlan(bus: I2CBus, gait_id):
+    """Compiled plan for a gait id, compiles all gaits the first time (or after the bus devices change)"""
+    
+    if bus.plans is None:
+        CompileGaits(bus)
+    
+    return bus.plans[gait_id]
+
+def MoveLegs(bus: I2CBus, inst, addresses=None):
     """Send commands to multiple legs in bus, waits until completion"""
     
-    fwd = Instruction(bus, inst)
+    fwd = Instruction(bus, inst, addresses)
     fwd.sendToLegs()
     fwd.checkFinished()
 
@@ -24,29 +62,41 @@ def CompleteOneMovementCycle(gait_type, bus: I2CBus):
     Execute a full cycle of movement as defined in a single gait from gaits.py
     """
     
-    # gait type is a list of tuples (len 6) specifying instructions
+    # latency is recorded per gait id (compiled plans)
+    with METRICS.time("gait_cycle", gait=getattr(gait_type, "gait_id", "table")):
+        RunMovementCycle(gait_type, bus)
+
+def RunMovementCycle(gait_type, bus: I2CBus):
+    
+    # gait type is a GaitPlan or a list of tuples (len 6) specifying instructions
+    addresses = getattr(gait_type, "addresses", None)
+    
+    if USE_LEG_SCHEDULER:
+        if addresses is None:
+            schedule = BuildSchedule(gait_type, bus.leg_addresses)
+        else:
+            schedule = ScheduleFor(gait_type)
+        
+        RunSchedule(bus, schedule)
+        print("Done with gait")
+        return
+    
     for inst in gait_type:
-        MoveLegs(bus, inst)
+        MoveLegs(bus, inst, addresses)
         print("Done with current instruction")
-        time.sleep(0.6)
+        time.sleep(STEP_SETTLE_TIME)
        
-def StopHoming(bus, curr_leg, joystick):
+def StopHoming(bus, curr_leg, presses):
     """
-    Returns whether or not to stop homing the motors
+    Returns whether or not to stop homing the motors, presses - buttons pressed since the last check (GMTJoystick.getPresses)
     """
-
-    _, _, _, _, b_btn, x_btn, left_joy = joystick.getControls()
     
-    if b_btn:
+    if "b" in presses:
         print("B button pressed, stopping")
         bus.devices[curr_leg].sendData(ACTION_DOWN)
     
-        done_moving = False
-                
-        # wait until done
-        while not done_moving:
-            print("waiting for leg down")
-            done_moving = bus.pollSingleLeg(bus.devices[curr_leg])
+        print("waiting for leg down")
+        WaitForLeg(bus, bus.devices[curr_leg])
             
         bus.devices[curr_leg].sendData(ACTION_ZERO)
         
@@ -55,7 +105,10 @@ def StopHoming(bus, curr_leg, joystick):
     else: 
         return False
 
-def JoystickToGait(x: int, y:int, coolness: bool, lift_lower: bool, send_to_home: bool, bus: I2CBus):
+def SelectGait(x: int, y: int, coolness: bool, lift_lower: bool, send_to_home: bool):
+    """
+    Returns the gait id for the given controls (None if nothing to do), toggles LIFT_LOWER
+    """
     
     # use the global variable for this
     global LIFT_LOWER
@@ -67,136 +120,194 @@ def JoystickToGait(x: int, y:int, coolness: bool, lift_lower: bool, send_to_home
         
         if LIFT_LOWER:
             print("lifting")
-            CompleteOneMovementCycle(gaits[GAIT_RAISE_ALL], bus)
+            return GAIT_RAISE_ALL
         
         else:
             print("lowering")
-            CompleteOneMovementCycle(gaits[GAIT_LOWER_ALL], bus)
+            return GAIT_LOWER_ALL
             
     elif send_to_home:
         print("Sending all motors back to home")
-        CompleteOneMovementCycle(gaits[GAIT_SEND_TO_HOME], bus)
+        return GAIT_SEND_TO_HOME
 
     elif coolness:
         print("Wiggle/Coolness fct")
-        CompleteOneMovementCycle(gaits[GAIT_COOL], bus)
+        return GAIT_COOL
     
     # handle d-pad inputs
-    elif x == 1:
-        print("Turn right")
-        CompleteOneMovementCycle(gaits[GAIT_SWIM_TURN_RIGHT], bus)
+    gait_id = DirectionGait(x, y)
+    
+    if gait_id is not None:
+        print(DIRECTION_NAMES[gait_id])
+    
+    return gait_id
+
+def DirectionGait(x: int, y: int):
+    """
+    Returns the gait id for a d-pad position (None if centred), left/right wins over up/down
+    """
+    
+    if x == 1:
+        return GAIT_SWIM_TURN_RIGHT
     
     elif x == -1:
-        print("Turn Left")
-        CompleteOneMovementCycle(gaits[GAIT_SWIM_TURN_LEFT], bus)
+        return GAIT_SWIM_TURN_LEFT
 
-    elif y==1:
-        print("Forward")
-        CompleteOneMovementCycle(gaits[GAIT_SWIM_FORWARD], bus)
+    elif y == 1:
+        return GAIT_SWIM_FORWARD
 
-        
     elif y == -1:
-        print("Back")
-        CompleteOneMovementCycle(gaits[GAIT_SWIM_BACKWARD], bus)
+        return GAIT_SWIM_BACKWARD
+    
+    return None
+
+def JoystickToGait(x: int, y:int, coolness: bool, lift_lower: bool, send_to_home: bool, bus: I2CBus):
+    
+    gait_id = SelectGait(x, y, coolness, lift_lower, send_to_home)
+    
+    if gait_id is not None:
+        CompleteOneMovementCycle(GetPlan(bus, gait_id), bus)
      
 
-def HomeMotors(bus, joystick):
+def WaitForLeg(bus, leg):
+    """Poll one leg until it reports done"""
+    
+    while not bus.pollSingleLeg(leg):
+        time.sleep(i2c_comm.POLL_INTERVAL)
+
+def AutoHomeMotors(bus):
+    """
+    Home every leg at once on its limit switch (ACTION_AUTO_HOME, the firmware drives the hip to the switch, backs off to home and zeroes)
+    Returns the names of legs that didn't home, to be homed with HomeMotors. A failed seek is only reported by the framed protocol, without it every leg is returned so each one is checked by hand
+    """
+    
+    print("Auto homing all legs")
+    
+    with METRICS.time("auto_home"):
+        CompleteOneMovementCycle(GetPlan(bus, GAIT_AUTO_HOME), bus)
+    
+    failed = []
+    
+    for device in bus.leg_order:
+        if not bus.isAvailable(device.address):
+            failed.append(device.name)
+            continue
+        
+        if not bus.framed:
+            # can't tell whether the seek found the switch, confirm the leg with manual homing
+            failed.append(device.name)
+            continue
+        
+        try:
+            if bus.telemetry is not None:
+                home_failed = bool(bus.telemetry.latest(device.address)["home_failed"])
+            else:
+                home_failed = device.readStatus().home_failed
+        
+        except (OSError, ValueError, TypeError, DeviceUnavailableError) as e:
+            print(f"{device.name} status not readable: {e}")
+            home_failed = True
+        
+        if home_failed:
+            failed.append(device.name)
+    
+    if failed and not bus.framed:
+        print("Homing failures aren't reported without the framed protocol, check every leg", failed)
+    elif failed:
+        print("Legs that didn't home", failed)
+    
+    return failed
+
+def HomeMotors(bus, joystick, legs=None):
     """
     Home hip motors individually via joystick. Use the B button to exit the homing loop, use Y button to move to each hip motor
     Use Y to exit the 
     Use d pad either x or y direction to move the hip forward or back
+    legs - names of the legs to home, defaults to all of them
     """
     
     # get all legs
-    legs = sorted(bus.devices.keys())
+    legs = sorted(bus.devices.keys()) if legs is None else sorted(legs)
+    
+    # buttons are edge triggered, presses from before homing started don't count
+    joystick.getPresses()
     
     print("Legs to home", legs)
     
     # for each leg, move until y btn is pressed again
     for i in range(len(legs)):
         
-        # store current leg as var
-        curr_leg = bus.devices[legs[i]]
+        # a leg that stops answering is reported and skipped instead of stalling homing
+        try:
         
-        # enter loop to home
-        finished = False
+            # store current leg as var
+            curr_leg = bus.devices[legs[i]]
         
-        # move leg up before homing
-        curr_leg.sendData(ACTION_UP)
+            # enter loop to home
+            finished = False
         
-        # allow user to adjust hip motor, if y_bt pressed, move to next one
-        while not finished:
+            # move leg up before homing
+            curr_leg.sendData(ACTION_UP)
+        
+            # allow user to adjust hip motor, if y_bt pressed, move to next one
+            while not finished:
+            
+                print(f"in homing loop for {legs[i]}")
+                time.sleep(HOMING_LOOP_DELAY)
             
-            print(f"in homing loop for {legs[i]}")
-            time.sleep(1)
+                # a Y or B still held from the last press isn't a new one
+                presses = joystick.getPresses()
             
-            # exit here if needed
-            stop = StopHoming(bus, legs[i], joystick)
-            print("Stop: ", stop)
+                # exit here if needed
+                stop = StopHoming(bus, legs[i], presses)
+                print("Stop: ", stop)
         
-            if stop:
-                return
+                if stop:
+                    return
             
-            x, y, a_btn, y_btn, b_btn, x_btn, left_joy = joystick.getControls()
+                x, y, a_btn, y_btn, b_btn, x_btn, left_joy = joystick.getControls()
             
-            print("y_btn value: ", y_btn)
-            print(x, y)
-        
-            # use y button to terminate homing for a single leg
-            if y_btn:
-                # move leg down after finshing homing
-                print(f"Finished homing {legs[i]}")
-                curr_leg.sendData(ACTION_DOWN)
-                
-                done_moving = False
+                print("presses: ", presses)
+                print(x, y)
+        
+                # use y button to terminate homing for a single leg
+                if "y" in presses:
+                    # move leg down after finshing homing
+                    print(f"Finished homing {legs[i]}")
+                    curr_leg.sendData(ACTION_DOWN)
                 
-                # wait until done
-                while not done_moving:
-                    done_moving = bus.pollSingleLeg(curr_leg)
+                    WaitForLeg(bus, curr_leg)
                     
-                # send home byte
-                curr_leg.sendData(ACTION_ZERO)
-                finished = True
+                    # send home byte
+                    curr_leg.sendData(ACTION_ZERO)
+                    finished = True
             
-            elif x == 1:
+                elif x == 1:
                 
-                print("fwd")
-                curr_leg.sendData(ACTION_HOME_FORWARD)
-                done_moving = False
-                
-                # wait until done
-                while not done_moving:
-                    done_moving = bus.pollSingleLeg(curr_leg)
+                    print("fwd")
+                    curr_leg.sendData(ACTION_HOME_FORWARD)
+                    WaitForLeg(bus, curr_leg)
                     
-            elif y == 1:
-                print("up")
-                curr_leg.sendData(ACTION_UP)
-                done_moving = False
-                
-                # wait until done
-                while not done_moving:
-                    done_moving = bus.pollSingleLeg(curr_leg)
+                elif y == 1:
+                    print("up")
+                    curr_leg.sendData(ACTION_UP)
+                    WaitForLeg(bus, curr_leg)
                     
-            elif x == -1:
+                elif x == -1:
                 
-                print("back")
-                bus.devices[legs[i]].sendData(ACTION_HOME_BACKWARD)
+                    print("back")
+                    bus.devices[legs[i]].sendData(ACTION_HOME_BACKWARD)
                 
-                done_moving = False
-                
-                # wait until done
-                while not done_moving:
-                    done_moving = bus.pollSingleLeg(curr_leg)
+                    WaitForLeg(bus, curr_leg)
                     
-            elif y == -1:
-                print("down")
-                bus.devices[legs[i]].sendData(ACTION_DOWN)
-                
-                done_moving = False
+                elif y == -1:
+                    print("down")
+                    bus.devices[legs[i]].sendData(ACTION_DOWN)
                 
-                # wait until done
-                while not done_moving:
-                    done_moving = bus.pollSingleLeg(curr_leg)
+                    WaitForLeg(bus, curr_leg)
+        
+        except (OSError, DeviceUnavailableError) as e:
+            print(f"{legs[i]} not responding, skipping: {e}")
         
 def TestOneLeg(x: int, y: int, bus: I2CBus):
     
@@ -0,0 +1,88 @@
+from gaits import ACTION_NONE, ACTION_FORWARD, ACTION_BACKWARD, ACTION_HOME_FORWARD, ACTION_HOME_BACKWARD, ACTION_AUTO_HOME
+
+"""
+Compiles the hardcoded gait tables in gaits.py into GaitPlans once at startup.
+
+Each table is checked (a list of steps, one action per leg, every action a known action byte) and flattened into a byte array in row major order, with the device address of each column stored alongside. Sending a step is then a slice of the plan, no sorting of the bus devices or walking of tuples.
+"""
+
+NUM_LEGS = 6
+
+# last valid action byte, the firmware ignores anything at or above 0x10
+MAX_ACTION = ACTION_AUTO_HOME
+
+# the firmware already swaps forward/backward on 0x13-0x15 (REVERSE_DIRECTION in leg_controller.ino),
+# only list addresses here for legs flashed without it, otherwise the swap happens twice
+REVERSED_ADDRESSES = ()
+
+REVERSED_ACTIONS = {
+    ACTION_FORWARD: ACTION_BACKWARD,
+    ACTION_BACKWARD: ACTION_FORWARD,
+    ACTION_HOME_FORWARD: ACTION_HOME_BACKWARD,
+    ACTION_HOME_BACKWARD: ACTION_HOME_FORWARD,
+}
+
+
+class GaitPlan:
+    __slots__ = ("gait_id", "addresses", "actions", "num_steps", "num_legs")
+
+    def __init__(self, gait_id, addresses, actions, num_steps):
+
+        self.gait_id = gait_id
+        self.addresses = addresses
+        self.actions = actions
+        self.num_steps = num_steps
+        self.num_legs = len(addresses)
+
+    def step(self, i):
+        # actions for one step, index j goes to addresses[j]
+        start = i * self.num_legs
+        return self.actions[start:start + self.num_legs]
+
+    def __len__(self):
+        return self.num_steps
+
+    def __iter__(self):
+        for i in range(self.num_steps):
+            yield self.step(i)
+
+
+def validateGait(gait_id, table):
+    """Raises ValueError if a gait table is not a list of steps of NUM_LEGS valid actions"""
+
+    if not isinstance(table, (list, tuple)) or len(table) == 0:
+        raise ValueError(f"Gait {gait_id} must be a non-empty list of steps")
+
+    for i, step in enumerate(table):
+
+        if not isinstance(step, (list, tuple)) or len(step) != NUM_LEGS:
+            raise ValueError(f"Gait {gait_id} step {i} must have one action per leg ({NUM_LEGS}), got {step!r}")
+
+        for action in step:
+            if not isinstance(action, int) or not ACTION_NONE <= action <= MAX_ACTION:
+                raise ValueError(f"Gait {gait_id} step {i} has invalid action {action!r}")
+
+
+def compileGait(gait_id, table, addresses, reversed_addresses=REVERSED_ADDRESSES):
+    """
+    Validates one gait table and maps its columns onto addresses (in leg order).
+    If there are fewer addresses than legs, only the first columns are kept (testing with fewer legs).
+    """
+
+    validateGait(gait_id, table)
+
+    addresses = tuple(addresses[:NUM_LEGS])
+    reverse = [address in reversed_addresses for address in addresses]
+
+    actions = bytearray()
+    for step in table:
+        for action, flip in zip(step, reverse):
+            actions.append(REVERSED_ACTIONS.get(action, action) if flip else action)
+
+    return GaitPlan(gait_id, addresses, bytes(actions), len(table))
+
+
+def compileGaits(gait_tables, addresses, reversed_addresses=REVERSED_ADDRESSES):
+    """Compile every table in gait_tables (gaits.gaits), returns a dict of gait id to GaitPlan"""
+
+    return {gait_id: compileGait(gait_id, table, addresses, reversed_addresses) for gait_id, table in gait_tables.items()}
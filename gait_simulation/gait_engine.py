@@ -0,0 +1,100 @@
+import mujoco as mj
+import numpy as np
+
+"""
+Vectorized gait engine for the MuJoCo simulator.
+
+Each gait mode is a table of all 12 actuator targets (knee1-6 then hip1-6) sampled over one PERIOD. The tables are built once with array operations, then every physics step is a single row lookup by phase and one fancy-indexed write into data.ctrl.
+"""
+
+LEGS = (1, 2, 3, 4, 5, 6)
+KNEE_ACTUATORS = tuple(f"knee{i}_act" for i in LEGS)
+HIP_ACTUATORS = tuple(f"hip{i}_act" for i in LEGS)
+
+# columns of every table
+ACTUATORS = KNEE_ACTUATORS + HIP_ACTUATORS
+
+# rows per table (about 2.4 ms per row at a 5 s period, close to the 2 ms timestep)
+TABLE_SIZE = 2048
+
+# tripod groups: legs 1, 3, 5 swing first, legs 2, 4, 6 half a period later
+GROUP_B = np.array([0, 1, 0, 1, 0, 1], dtype=bool)
+
+# per leg signs (legs 1-6), mirrored legs move the opposite way
+WALK_KNEE_SIGN = np.array([1, 1, 1, -1, -1, -1], dtype=float)
+WALK_HIP_SIGN = np.array([1, 1, 1, -1, -1, -1], dtype=float)
+ROTATE_HIP_SIGN = np.ones(6)
+
+
+def DutyCycle(t, period, duty_cycle, hip_swing, phase_offset=0.0):
+    """
+    Returns (knee_lift, hip_angle) arrays for times t with a given phase offset (scalar or per column).
+    knee_lift is 0 when grounded, 1 when fully lifted.
+    """
+
+    # normalize time to [0, 1) within this period, with offset
+    t = np.mod(t - phase_offset, period) / period
+    swing = t < duty_cycle
+
+    # knee: half-cosine bump during swing, grounded during stance
+    knee_lift = np.where(swing, 0.5 * (1 - np.cos(np.pi * t / duty_cycle)), 0.0)
+
+    # hip: swing forward over the full HIP_SWING range, then return smoothly during stance
+    t_stance = (t - duty_cycle) / (1.0 - duty_cycle)
+    hip_angle = np.where(swing, hip_swing * 0.5 * np.cos(np.pi * t / duty_cycle), -hip_swing * 0.5 * np.cos(np.pi * t_stance))
+
+    return knee_lift, hip_angle
+
+
+def TripodTable(t, period, duty_cycle, hip_swing, leg_up, knee_sign, hip_sign):
+    # (rows, 12) knee then hip targets for a tripod gait
+    offsets = np.where(GROUP_B, period * 0.5, 0.0)
+    knee_lift, hip_angle = DutyCycle(t[:, None], period, duty_cycle, hip_swing, offsets[None, :])
+
+    return np.hstack([knee_lift * leg_up * knee_sign, hip_angle * hip_sign])
+
+
+def WiggleTable(t, period, hip_swing):
+    # (rows, 6) hip targets, the knees are left where they are
+    right = (hip_swing * 0.5) * (np.sin(2 * np.pi * t / period) + .1)
+    left = (hip_swing * 0.5) * np.sin(2 * np.pi * (t + period) / period)
+
+    return np.where(GROUP_B[None, :], left[:, None], right[:, None])
+
+
+class GaitEngine:
+    def __init__(self, model, period=5.0, duty_cycle=0.4, hip_swing=np.radians(40), leg_up=100, table_size=TABLE_SIZE):
+
+        self.period = period
+        self.table_size = table_size
+
+        knee_ids = np.array([mj.mj_name2id(model, mj.mjtObj.mjOBJ_ACTUATOR, name) for name in KNEE_ACTUATORS])
+        hip_ids = np.array([mj.mj_name2id(model, mj.mjtObj.mjOBJ_ACTUATOR, name) for name in HIP_ACTUATORS])
+        all_ids = np.concatenate([knee_ids, hip_ids])
+
+        # sample times over one period
+        t = np.arange(table_size) * (period / table_size)
+
+        # mode -> (actuator ids, table of targets)
+        self.tables = {
+            "walk": (all_ids, TripodTable(t, period, duty_cycle, hip_swing, leg_up, WALK_KNEE_SIGN, WALK_HIP_SIGN)),
+            "rotate": (all_ids, TripodTable(t, period, duty_cycle, hip_swing, leg_up, WALK_KNEE_SIGN, ROTATE_HIP_SIGN)),
+            "fun": (hip_ids, WiggleTable(t, period, hip_swing)),
+        }
+
+    def modes(self):
+        return set(self.tables)
+
+    def row(self, elapsed):
+        # table row for a time in seconds
+        return int((elapsed % self.period) / self.period * self.table_size) % self.table_size
+
+    def targets(self, mode, elapsed):
+        ids, table = self.tables[mode]
+        return ids, table[self.row(elapsed)]
+
+    def apply(self, data, mode, elapsed):
+        """Write every actuator target for mode at elapsed seconds into data.ctrl"""
+
+        ids, table = self.tables[mode]
+        data.ctrl[ids] = table[self.row(elapsed)]
@@ -0,0 +1,130 @@
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+
+import mujoco as mj
+import numpy as np
+
+from gait_engine import GaitEngine
+from sim_model import LoadModel, TorsoQposAddresses, TORSO_JOINTS, LEG_MASS, TORSO_MASS
+
+"""
+Headless gait parameter sweep.
+
+Runs every combination of the given PERIOD, DUTY_CYCLE, HIP_SWING and LEG_UP values as a rollout with no viewer, spread over a process pool. Each worker loads the model once and gives every rollout its own MjData. A rollout reports how far the torso moved along torso_x, torso_y and torso_yaw per simulated second.
+
+    python gait_sweep.py walk --period 3 4 5 --duty-cycle 0.3 0.4 0.5 --hip-swing 30 40 --duration 20 --output walk.csv
+"""
+
+# per worker process, set by InitWorker
+MODEL = None
+TORSO_QPOS = None
+
+
+def InitWorker(leg_mass, torso_mass):
+    global MODEL, TORSO_QPOS
+
+    MODEL = LoadModel(leg_mass=leg_mass, torso_mass=torso_mass)
+    TORSO_QPOS = TorsoQposAddresses(MODEL)
+
+
+def Rollout(job):
+    """
+    Simulate one gait configuration for duration seconds of sim time, returns the job with the torso displacement rates added
+    """
+
+    mode, period, duty_cycle, hip_swing, leg_up, duration = job
+
+    data = mj.MjData(MODEL)
+    engine = GaitEngine(MODEL, period=period, duty_cycle=duty_cycle, hip_swing=np.radians(hip_swing), leg_up=leg_up)
+
+    start = data.qpos[TORSO_QPOS].copy()
+    steps = int(round(duration / MODEL.opt.timestep))
+    wall_start = time.perf_counter()
+
+    for _ in range(steps):
+        # gait phase from sim time, so results don't depend on how fast the machine is
+        engine.apply(data, mode, data.time)
+        mj.mj_step(MODEL, data)
+
+    rates = (data.qpos[TORSO_QPOS] - start) / data.time
+    stable = bool(np.all(np.isfinite(data.qpos)))
+
+    result = {
+        "mode": mode,
+        "period": period,
+        "duty_cycle": duty_cycle,
+        "hip_swing": hip_swing,
+        "leg_up": leg_up,
+        "sim_time": data.time,
+        "wall_time": time.perf_counter() - wall_start,
+        "stable": stable,
+    }
+    result.update({f"{name}_per_s": float(rate) for name, rate in zip(TORSO_JOINTS, rates)})
+
+    return result
+
+
+def MakeJobs(args):
+    # every combination of the swept values
+    grid = itertools.product(args.period, args.duty_cycle, args.hip_swing, args.leg_up)
+
+    return [(args.mode, period, duty_cycle, hip_swing, leg_up, args.duration) for period, duty_cycle, hip_swing, leg_up in grid]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless sweep of gait parameters")
+    parser.add_argument("mode", choices=("walk", "rotate", "fun"))
+    parser.add_argument("--period", type=float, nargs="+", default=[5.0], help="seconds per gait cycle")
+    parser.add_argument("--duty-cycle", type=float, nargs="+", default=[0.4], help="fraction of the period a leg is lifted")
+    parser.add_argument("--hip-swing", type=float, nargs="+", default=[40.0], help="hip swing in degrees")
+    parser.add_argument("--leg-up", type=float, nargs="+", default=[100.0], help="knee lift target")
+    parser.add_argument("--duration", type=float, default=20.0, help="simulated seconds per rollout")
+    parser.add_argument("--leg-mass", type=float, default=LEG_MASS)
+    parser.add_argument("--torso-mass", type=float, default=TORSO_MASS)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes in the pool")
+    parser.add_argument("--output", help="write every result to this CSV file")
+    parser.add_argument("--top", type=int, default=10, help="results to print")
+    args = parser.parse_args(argv)
+
+    jobs = MakeJobs(args)
+    print(f"Running {len(jobs)} rollouts of {args.duration}s on {args.workers} workers")
+
+    # compile into the model cache once, so the workers only load the .mjb
+    LoadModel(leg_mass=args.leg_mass, torso_mass=args.torso_mass)
+
+    results = []
+    start = time.perf_counter()
+
+    with multiprocessing.Pool(args.workers, initializer=InitWorker, initargs=(args.leg_mass, args.torso_mass)) as pool:
+        for result in pool.imap_unordered(Rollout, jobs):
+            results.append(result)
+            print(f"\r{len(results)}/{len(jobs)}", end="", flush=True)
+
+    print(f"\nDone in {time.perf_counter() - start:.1f}s")
+
+    # walking is scored by forward speed, rotating by turn rate
+    key = "torso_yaw_per_s" if args.mode == "rotate" else "torso_x_per_s"
+    results.sort(key=lambda result: abs(result[key]) if result["stable"] else -1, reverse=True)
+
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+        print(f"Wrote {len(results)} results to {args.output}")
+
+    print(f"{'period':>7} {'duty':>5} {'swing':>6} {'leg_up':>7} {'x/s':>8} {'y/s':>8} {'yaw/s':>8}")
+    for result in results[:args.top]:
+        print(f"{result['period']:>7.2f} {result['duty_cycle']:>5.2f} {result['hip_swing']:>6.1f} {result['leg_up']:>7.1f} "
+              f"{result['torso_x_per_s']:>8.4f} {result['torso_y_per_s']:>8.4f} {result['torso_yaw_per_s']:>8.4f}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
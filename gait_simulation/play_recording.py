@@ -0,0 +1,49 @@
+import os
+import sys
+
+import mujoco as mj
+import mujoco.viewer
+
+from realtime import RealTimeStepper
+from sim_model import LoadModel, TorsoQposAddresses, TORSO_JOINTS
+
+# recorder.py lives with the Pi code in the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from recorder import Recording, PlayIntoSim
+
+"""
+Replay a recording from hexapod_gait_simulator.py (GMT_RECORD=<dir>) in the viewer, or headless with --headless to check it reproduces the recorded trajectory.
+"""
+
+
+def ControlsFrom(recording):
+    # recorded actuator targets one row at a time, holding the last one once the recording ends
+    rows = (ctrl for chunk in recording.chunks() for ctrl in chunk["ctrl"])
+    last = None
+
+    def control(data):
+        nonlocal last
+        last = next(rows, last)
+
+        if last is not None:
+            data.ctrl[:] = last
+
+    return control
+
+
+if len(sys.argv) < 2:
+    print("Usage: mjpython play_recording.py <recording dir> [--headless]")
+    sys.exit(1)
+
+recording = Recording(sys.argv[1])
+model = LoadModel()
+data = mj.MjData(model)
+
+if "--headless" in sys.argv:
+    PlayIntoSim(recording, model, data)
+    torso = {name: round(float(value), 4) for name, value in zip(TORSO_JOINTS, data.qpos[TorsoQposAddresses(model)])}
+    print(f"Played {len(recording)} steps, final torso position {torso}")
+    sys.exit(0)
+
+with mujoco.viewer.launch_passive(model, data) as viewer:
+    RealTimeStepper(model, data).run(viewer, ControlsFrom(recording))
@@ -0,0 +1,72 @@
+import time
+
+import mujoco as mj
+
+"""
+Real-time stepping for the viewer.
+
+RealTimeStepper keeps sim time at a target real-time factor (RTF) of wall time. Each display frame it runs as many physics substeps as needed to catch sim time up to wall time * RTF, syncs the viewer once, then sleeps until the next frame. Physics runs at the model timestep and the viewer at display_hz, so gait timing in the sim matches the robot no matter how long a step takes to compute.
+
+If the machine can't keep up, at most max_substeps are run per frame and the lag is dropped instead of caught up in a burst. The achieved RTF is printed every report_interval seconds.
+"""
+
+DISPLAY_HZ = 60
+
+# more than this many substeps per frame and the sim is behind, drop the lag
+MAX_SUBSTEPS = 200
+
+
+class RealTimeStepper:
+    def __init__(self, model, data, rtf=1.0, display_hz=DISPLAY_HZ, max_substeps=MAX_SUBSTEPS, report_interval=2.0):
+
+        self.model = model
+        self.data = data
+        self.rtf = rtf
+        self.frame_time = 1.0 / display_hz
+        self.max_substeps = max_substeps
+        self.report_interval = report_interval
+
+        # achieved RTF over the last report interval
+        self.achieved_rtf = 0.0
+
+    def run(self, viewer, control):
+        """
+        Step until the viewer closes, control(data) is called before every physics step to set data.ctrl
+        """
+
+        timestep = self.model.opt.timestep
+
+        # wall and sim time the target is measured from
+        wall_anchor = time.perf_counter()
+        sim_anchor = self.data.time
+
+        report_wall = wall_anchor
+        report_sim = sim_anchor
+        next_frame = wall_anchor
+
+        while viewer.is_running():
+            now = time.perf_counter()
+            target = sim_anchor + (now - wall_anchor) * self.rtf
+
+            substeps = 0
+            while self.data.time + timestep / 2 < target and substeps < self.max_substeps:
+                control(self.data)
+                mj.mj_step(self.model, self.data)
+                substeps += 1
+
+            if substeps == self.max_substeps:
+                # behind, restart the target from here rather than running a burst of steps to catch up
+                wall_anchor = time.perf_counter()
+                sim_anchor = self.data.time
+
+            viewer.sync()
+
+            if now - report_wall >= self.report_interval:
+                self.achieved_rtf = (self.data.time - report_sim) / (now - report_wall)
+                print(f"real-time factor {self.achieved_rtf:.2f} (target {self.rtf:.2f})")
+                report_wall = now
+                report_sim = self.data.time
+
+            # sleep until the next display frame
+            next_frame = max(next_frame + self.frame_time, time.perf_counter())
+            time.sleep(max(0.0, next_frame - time.perf_counter()))
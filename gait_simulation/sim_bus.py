@@ -0,0 +1,143 @@
+import argparse
+import os
+import sys
+import time
+
+import mujoco as mj
+import numpy as np
+
+from gait_engine import KNEE_ACTUATORS, HIP_ACTUATORS
+from sim_model import LoadModel, TorsoQposAddresses, TORSO_JOINTS
+
+# the bus, emulator and gait code live in the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from leg_emulator import LegEmulator, DEFAULT_ADDRESSES
+
+"""
+Simulated bus backend, runs the gaits.py action tables on the MuJoCo model instead of real legs.
+
+SimLegs class - leg_emulator.LegEmulator clocked by sim time instead of wall time. Each leg is an EmulatedLeg, the emulator's copy of the firmware state machine and timing model, and its hip angle and knee lift are written to the leg's actuators every physics step. The model is stepped on each bus transaction until sim time catches up with wall time * rtf, so the Pi code's polling and sleeps see the same timing as on the robot.
+
+    python sim_bus.py --gait 0 --cycles 3 --rtf 5
+"""
+
+# knee actuator target when fully lifted and sign per leg, same as the walk gait in gait_engine.py
+LEG_UP = 100
+KNEE_SIGN = np.array([1, 1, 1, -1, -1, -1], dtype=float)
+
+# firmware hip angles already include the REVERSE_DIRECTION flip for legs 4-6, so no extra sign here
+HIP_SIGN = np.ones(6)
+
+
+class SimLegs(LegEmulator):
+    def __init__(self, model=None, addresses=DEFAULT_ADDRESSES, rtf=1.0, leg_up=LEG_UP, action_times=None):
+        """
+        model - MjModel to drive, defaults to sim_model.LoadModel()
+        rtf - sim seconds per wall second, above 1 runs gaits faster than the robot
+        action_times - optional {action: seconds} to use instead of the firmware timing model
+        """
+
+        self.model = model if model is not None else LoadModel()
+        self.data = mj.MjData(self.model)
+        self.rtf = rtf
+        self.leg_up = leg_up
+
+        super().__init__(addresses, clock=self.simTime, action_times=action_times)
+
+        # actuator ids in leg order
+        self.knee_ids = np.array([mj.mj_name2id(self.model, mj.mjtObj.mjOBJ_ACTUATOR, name) for name in KNEE_ACTUATORS[:len(addresses)]])
+        self.hip_ids = np.array([mj.mj_name2id(self.model, mj.mjtObj.mjOBJ_ACTUATOR, name) for name in HIP_ACTUATORS[:len(addresses)]])
+
+        self.torso_qpos = TorsoQposAddresses(self.model)
+        self.wall_start = time.perf_counter()
+
+    def simTime(self):
+        return self.data.time
+
+    def applyTargets(self):
+        now = self.data.time
+        legs = list(self.legs.values())
+
+        self.data.ctrl[self.knee_ids] = [leg.kneeLiftAt(now) for leg in legs] * KNEE_SIGN[:len(legs)] * self.leg_up
+        self.data.ctrl[self.hip_ids] = np.radians([leg.angleAt(now) for leg in legs]) * HIP_SIGN[:len(legs)]
+
+    def advance(self):
+        # step the physics until sim time catches up with wall time
+        target = (time.perf_counter() - self.wall_start) * self.rtf
+        timestep = self.model.opt.timestep
+
+        while self.data.time + timestep / 2 < target:
+            for leg in self.legs.values():
+                leg.update()
+
+            self.applyTargets()
+            mj.mj_step(self.model, self.data)
+
+    def transaction(self):
+        # every bus transaction first brings the model up to the current time
+        self.advance()
+
+    def torso(self):
+        """Torso position along each of the torso joints"""
+
+        with self.lock:
+            self.advance()
+            return {name: float(self.data.qpos[i]) for name, i in zip(TORSO_JOINTS, self.torso_qpos)}
+
+
+def makeSimBus(model=None, addresses=DEFAULT_ADDRESSES, rtf=1.0, action_times=None, framed=False):
+    """Returns an I2CBus with a GMTIno for each address, backed by SimLegs"""
+
+    from i2c_comm import I2CBus, GMTIno
+
+    bus = I2CBus(SimLegs(model, addresses, rtf=rtf, action_times=action_times), framed=framed)
+    bus.addDevices(*[GMTIno(f"leg{i + 1}", address) for i, address in enumerate(addresses)])
+
+    return bus
+
+
+def main(argv=None):
+    import i2c_comm
+    import gait_and_homing
+    import leg_scheduler
+    from gait_and_homing import CompleteOneMovementCycle, GetPlan
+    from metrics import METRICS
+    from gaits import gaits
+
+    parser = argparse.ArgumentParser(description="Run a gait from gaits.py on the simulated hexapod")
+    parser.add_argument("--gait", type=int, default=0, choices=sorted(gaits), help="gait id from gaits.py")
+    parser.add_argument("--cycles", type=int, default=3)
+    parser.add_argument("--rtf", type=float, default=1.0, help="sim seconds per wall second")
+    parser.add_argument("--framed", action="store_true", help="use the framed protocol")
+    args = parser.parse_args(argv)
+
+    bus = makeSimBus(rtf=args.rtf, framed=args.framed)
+    sim = bus.bus
+    plan = GetPlan(bus, args.gait)
+
+    # Pi side sleeps follow the sim speed
+    for module, name in ((i2c_comm, "POLL_INTERVAL"), (leg_scheduler, "POLL_INTERVAL"), (i2c_comm, "SEND_DELAY"), (gait_and_homing, "STEP_SETTLE_TIME")):
+        setattr(module, name, getattr(module, name) / args.rtf)
+
+    start_torso = sim.torso()
+
+    for cycle in range(args.cycles):
+        sim_start = sim.simTime()
+        CompleteOneMovementCycle(plan, bus)
+        print(f"cycle {cycle + 1}: {sim.simTime() - sim_start:.2f} sim seconds")
+
+    end_torso = sim.torso()
+
+    print(f"{sim.writes} writes, {sim.reads} reads")
+    print("torso moved", {name: round(end_torso[name] - start_torso[name], 4) for name in TORSO_JOINTS})
+
+    # wall time latencies, divide by rtf for robot time
+    for entry in METRICS.snapshot()["latency"]:
+        if entry["op"] in ("gait_cycle", "leg_action"):
+            print(entry["op"], entry["labels"], f"p50 {entry['p50']:.3f}s p95 {entry['p95']:.3f}s count {entry['count']}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import hashlib
+import os
+import xml.etree.ElementTree as ET
+
+import mujoco as mj
+
+"""
+Loading of the hexapod model for the viewer and the headless tools.
+
+LoadModel reads hexapod.xml (relative to this file, so scripts can run from anywhere) and applies the leg and torso mass overrides.
+
+Parsing the XML and the OBJ meshes in blender_obj/ is most of the startup time, so the compiled model (masses included) is saved in MuJoCo's binary .mjb format under .model_cache/. The cache file is named by a hash of the XML, every file it references, the masses and the MuJoCo version, so editing any of them compiles a fresh one on the next run.
+"""
+
+SIM_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.path.join(SIM_DIR, "hexapod.xml")
+
+# mass in kg
+LEG_MASS = 2
+TORSO_MASS = 70
+
+CACHE_DIR = os.path.join(SIM_DIR, ".model_cache")
+
+LEG_BODIES = tuple(f"leg{i}" for i in range(1, 7))
+
+# joints the torso moves along, see hexapod.xml
+TORSO_JOINTS = ("torso_x", "torso_y", "torso_yaw")
+
+
+def SetMasses(model, leg_mass=LEG_MASS, torso_mass=TORSO_MASS):
+    # https://mujoco.readthedocs.io/en/stable/computation/index.html#geactuation
+    for name in LEG_BODIES:
+        model.body_mass[mj.mj_name2id(model, mj.mjtObj.mjOBJ_BODY, name)] = leg_mass
+
+    model.body_mass[mj.mj_name2id(model, mj.mjtObj.mjOBJ_BODY, "torso")] = torso_mass
+
+
+def ModelHash(path, leg_mass, torso_mass):
+    """Hash of everything the compiled model depends on"""
+
+    digest = hashlib.sha256()
+    digest.update(mj.mj_versionString().encode())
+    digest.update(f"{leg_mass!r} {torso_mass!r}".encode())
+
+    with open(path, "rb") as f:
+        digest.update(f.read())
+
+    # meshes and any other files the XML points at, relative to the XML
+    model_dir = os.path.dirname(os.path.abspath(path))
+    files = sorted(set(element.get("file") for element in ET.parse(path).iter() if element.get("file")))
+
+    for name in files:
+        digest.update(name.encode())
+        with open(os.path.join(model_dir, name), "rb") as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+def LoadModel(path=MODEL_PATH, leg_mass=LEG_MASS, torso_mass=TORSO_MASS, cache=True):
+    """Returns the MjModel at path with the mass overrides applied, from the .mjb cache when it is up to date"""
+
+    if not cache:
+        model = mj.MjModel.from_xml_path(path)
+        SetMasses(model, leg_mass, torso_mass)
+        return model
+
+    cached = os.path.join(CACHE_DIR, ModelHash(path, leg_mass, torso_mass)[:16] + ".mjb")
+
+    if os.path.exists(cached):
+        return mj.MjModel.from_binary_path(cached)
+
+    model = mj.MjModel.from_xml_path(path)
+    SetMasses(model, leg_mass, torso_mass)
+
+    # write then rename, sweep workers may compile at the same time
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = f"{cached}.{os.getpid()}.tmp"
+    mj.mj_saveModel(model, tmp, None)
+    os.replace(tmp, cached)
+
+    return model
+
+
+def TorsoQposAddresses(model):
+    # qpos index of each torso joint, in TORSO_JOINTS order
+    return [model.jnt_qposadr[mj.mj_name2id(model, mj.mjtObj.mjOBJ_JOINT, name)] for name in TORSO_JOINTS]
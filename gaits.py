@@ -21,6 +21,7 @@ ACTION_HOME_FORWARD = 5
 ACTION_HOME_BACKWARD = 6
 ACTION_ZERO = 7
 ACTION_SEND_HOME = 8
+ACTION_AUTO_HOME = 9
 
 # GAITS
 GAIT_FORWARD = 0
@@ -39,6 +40,7 @@ GAIT_SWIM_BACKWARD = 12
 
 GAIT_SEND_TO_HOME = 13
 GAIT_SET_HOME = 14
+GAIT_AUTO_HOME = 15
 
 gaits = {
 
@@ -190,6 +192,11 @@ gaits = {
     ],
     
     GAIT_SET_HOME: [
-        ACTION_ZERO, ACTION_ZERO, ACTION_ZERO, ACTION_ZERO, ACTION_ZERO, ACTION_ZERO
+        (ACTION_ZERO, ACTION_ZERO, ACTION_ZERO, ACTION_ZERO, ACTION_ZERO, ACTION_ZERO)
+    ],
+    
+    # every leg finds its limit switch, backs off to home and zeroes at the same time
+    GAIT_AUTO_HOME: [
+        (ACTION_AUTO_HOME, ACTION_AUTO_HOME, ACTION_AUTO_HOME, ACTION_AUTO_HOME, ACTION_AUTO_HOME, ACTION_AUTO_HOME)
     ]
 }
\ No newline at end of file
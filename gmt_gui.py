@@ -1,9 +1,7 @@
-from PyQt5.QtCore import QSize, QTimer
+from PyQt5.QtCore import QSize, QThread, pyqtSignal
 from PyQt5.QtWidgets import QWidget, QApplication, QMainWindow, QVBoxLayout, QLabel, QSizePolicy
 import sys
 import pygame
-# later call funcs from other file
-from joystick import startJoystick
 
 # for plot styling
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
@@ -11,8 +9,16 @@ from matplotlib.figure import Figure
 
 """
 GUI to display xbox controls, used for the demo to verify connection between Raspberry Pi and Xbox controller
+
+The controller is polled on a JoystickPoller thread, which only emits a signal when the stick position or connection status changes. The plot is blitted: the axes, grid and labels are drawn once and cached, and each update restores that background and redraws just the dot and crosshair lines.
 """
 
+# controller poll interval in ms (~60 Hz)
+POLL_MS = 16
+
+# stick dead zone
+DEAD_ZONE = 0.05
+
 # Python GUI - plot motor controls
 
 # design the main window
@@ -32,12 +38,16 @@ class JoystickPlot(QWidget):
         self.ax = self.figure.add_subplot(111)
         self.DrawAxes()
 
-        # dot
-        (self.dot,) = self.ax.plot(0, 0, "o", color="#e94560", markersize=14, zorder=5)
+        # dot, animated so full redraws leave it out of the cached background
+        (self.dot,) = self.ax.plot(0, 0, "o", color="#e94560", markersize=14, zorder=5, animated=True)
 
         # make dot easier to see
-        self.hline = self.ax.axhline(0, color="#e94560", linewidth=0.6, alpha=0.4, zorder=4)
-        self.vline = self.ax.axvline(0, color="#e94560", linewidth=0.6, alpha=0.4, zorder=4)
+        self.hline = self.ax.axhline(0, color="#e94560", linewidth=0.6, alpha=0.4, zorder=4, animated=True)
+        self.vline = self.ax.axvline(0, color="#e94560", linewidth=0.6, alpha=0.4, zorder=4, animated=True)
+
+        # static part of the figure, grabbed after every full draw (first show, resize)
+        self.background = None
+        self.canvas.mpl_connect("draw_event", self.onDraw)
 
         layout = QVBoxLayout()
         layout.setContentsMargins(0, 0, 0, 0)
@@ -75,14 +85,95 @@ class JoystickPlot(QWidget):
 
         self.figure.tight_layout()
 
+    def onDraw(self, event):
+        # cache the background and put the moving artists back on top
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self.drawArtists()
+
+    def drawArtists(self):
+        for artist in (self.hline, self.vline, self.dot):
+            self.ax.draw_artist(artist)
+
     def UpdatePosition(self, x, y):
-        # updates the joystick position on the plot
+        # updates the joystick position on the plot, only the dot and lines are redrawn
         self.x_val = x
         self.y_val = y
         self.dot.set_data([x], [y])
         self.hline.set_ydata([y])
         self.vline.set_xdata([x])
-        self.canvas.draw_idle()
+
+        if self.background is None:
+            # not drawn yet, onDraw picks up the new position
+            self.canvas.draw_idle()
+            return
+
+        self.canvas.restore_region(self.background)
+        self.drawArtists()
+        self.canvas.blit(self.figure.bbox)
+
+
+class JoystickPoller(QThread):
+    # right stick position and controller status, emitted only when they change
+    positionChanged = pyqtSignal(float, float)
+    statusChanged = pyqtSignal(str)
+
+    def __init__(self, interval_ms=POLL_MS):
+        super().__init__()
+
+        self.interval_ms = interval_ms
+        self.joystick = None
+
+    def findController(self):
+        # first controller, None if there isn't one
+        if pygame.joystick.get_count() == 0:
+            return None
+
+        joystick = pygame.joystick.Joystick(0)
+        joystick.init()
+        return joystick
+
+    def run(self):
+        pygame.init()
+        pygame.joystick.init()
+
+        position = None
+        status = None
+
+        while not self.isInterruptionRequested():
+
+            # start processing controls
+            pygame.event.pump()
+
+            # reconnect if none
+            if self.joystick is None:
+                self.joystick = self.findController()
+
+            try:
+                new_status = f"Controller: {self.joystick.get_name()}" if self.joystick else "no controller"
+
+                if self.joystick is not None:
+                    # get axes (right joystick only)
+                    x = self.joystick.get_axis(3)
+                    y = -self.joystick.get_axis(4)
+
+                    # dead threshold, rounded to what the label shows so noise doesn't count as a change
+                    x = round(x, 3) if abs(x) > DEAD_ZONE else 0.0
+                    y = round(y, 3) if abs(y) > DEAD_ZONE else 0.0
+
+                    if (x, y) != position:
+                        position = (x, y)
+                        self.positionChanged.emit(x, y)
+
+            # disconnect if any errors
+            except Exception:
+                self.joystick = None
+                new_status = "Controller: Disconnected"
+
+            if new_status != status:
+                status = new_status
+                self.statusChanged.emit(status)
+
+            self.msleep(self.interval_ms)
         
 
 class MainInterface(QMainWindow):
@@ -99,15 +190,10 @@ class MainInterface(QMainWindow):
         central_widget = QWidget()
         main_layout = QVBoxLayout()
         
-        # init joystick
-        self.joystick = startJoystick()
-        self.x_val = -999
-        self.y_val = -999
-        
         title = QLabel("Right Joystick")
         title.setStyleSheet("font-size: 20px; color: #8888cc; padding-bottom: 6px;")
 
-        self.status_label = QLabel(self.joystickStatus())
+        self.status_label = QLabel("Finding controller")
         self.status_label.setStyleSheet("font-size: 18px; color: #5555aa; padding-bottom: 4px;")
 
         self.coord_label = QLabel("X: tbd   Y: tbd")
@@ -140,45 +226,21 @@ class MainInterface(QMainWindow):
         central_widget.setLayout(main_layout)
         self.setCentralWidget(central_widget)
 
-        # poll joystick at ~60 Hz
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.pollJoystick)
-        self.timer.start(16)
-
-    def joystickStatus(self):
-        if self.joystick:
-            return f"Controller: {self.joystick.get_name()}"
-        return "no controller"
-
-    def pollJoystick(self):
-        
-        # start processing controls
-        pygame.event.pump()
-
-        # reconnect if none
-        if self.joystick is None:
-            self.joystick = startJoystick()
-            self.status_label.setText(self.joystickStatus())
-
-        try:
-            # get axes (right joystick only)
-            x = self.joystick.get_axis(3)
-            y = -self.joystick.get_axis(4)
-            print(x,y)
-
-            # dead threshold
-            dead_zone = 0.05
-            x = x if abs(x) > dead_zone else 0.0
-            y = y if abs(y) > dead_zone else 0.0
-
-            # update plot position and coordinates
-            self.joystick_plot.UpdatePosition(x, y)
-            self.coord_label.setText(f"X: {x:+.3f}   Y: {y:+.3f}")
-
-        # disconnect if any errors
-        except Exception:
-            self.joystick = None
-            self.status_label.setText("Controller: Disconnected")
+        # poll joystick at ~60 Hz off the Qt thread, updates arrive as queued signals
+        self.poller = JoystickPoller()
+        self.poller.positionChanged.connect(self.updatePosition)
+        self.poller.statusChanged.connect(self.status_label.setText)
+        self.poller.start()
+
+    def updatePosition(self, x, y):
+        # update plot position and coordinates
+        self.joystick_plot.UpdatePosition(x, y)
+        self.coord_label.setText(f"X: {x:+.3f}   Y: {y:+.3f}")
+
+    def closeEvent(self, event):
+        self.poller.requestInterruption()
+        self.poller.wait()
+        super().closeEvent(event)
         
 # run the app
 if __name__ == "__main__":
@@ -1,127 +1,826 @@
-import smbus2
 from typing import Tuple
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import time
 
+from event_log import LOG, DEBUG
+from metrics import METRICS
+
 """
 Classes for sending instructions between the Pi and Arduinos.
 Instruction class - dictates a set of 6 instructions each sent to the individual Arduinos in the bus. Includes a method to directly send to the legs in the bus and check whether each instruction has been completed.
 
-I2CBus class - main class to keep track of all items in the bus, contains a polling function to read bytes from each device in the bus, includes read and write byte functions which use the smbus2 implementations of the bus 
+I2CBus class - main class to keep track of all items in the bus, contains polling functions to read bytes from each device in the bus, includes read and write byte functions which use the smbus2 implementations of the bus. Any object with smbus2's write_byte/read_byte can be passed in as the backend instead (see leg_emulator.py for running off the robot)
+
+The legs can be spread over several I2C adapters (e.g. i2c-1 plus an overlay bus). Each extra adapter is another backend, legs are assigned to adapters by address, and every adapter gets its own worker thread so dispatch and polling run on all adapters at the same time
+
+Bus transactions are logged through event_log.LOG (set GMT_LOG_LEVEL=debug to see every transaction) and timed in metrics.METRICS, along with I2C errors per address
+
+DeviceHealth class - per address circuit breaker. Every transaction is retried with exponential backoff, after FAILURE_THRESHOLD failed transactions in a row the leg is marked unavailable and further transactions raise DeviceUnavailableError until a probe after the cooldown succeeds. Unavailable legs are skipped by dispatch and dropped from polling, so a dead leg is reported instead of stalling every wait on the bus. The general call GO is retried the same way but has no breaker. If it still fails it is logged and each staged leg is sent its action directly, which also clears what it had staged, so no leg is left holding an action for the next GO
+
+Framed protocol (I2CBus framed=True, matches leg_controller.ino) - instead of one action byte down and one done byte up, each leg is sent a frame with the action, magnitude, speed and a sequence number, and returns a status with the done flag, hip angle, ground contact, limit switch and the last sequence number it accepted. A leg busy with an action rejects new frames, so a leg that reports done with an older sequence number than the last one sent dropped that frame, it is logged and sent once more before polling gives up on it. Frames to every leg plus the general call GO, and the status reads of every leg, each go out as one i2c_rdwr transfer per adapter. With telemetry.Telemetry running the statuses are read in the background and polling uses its samples
+
+GPIODoneLine class - optional shared "all done" line from the legs, lets the Pi wait on an edge instead of polling the bus
 
 GMTIno class - used to represent a single Arduino, contains indentifiers such as the name and device address. These are the objects in the I2CBus
 """
 
+# stage-then-commit protocol (matches leg_controller.ino)
+# each leg is sent CMD_STAGE | action, then one general call CMD_GO starts all of them at once
+GENERAL_CALL_ADDRESS = 0x00
+CMD_STAGE = 0x20
+CMD_GO = 0x40
+
+# delay between legs when sending actions one at a time (no broadcast)
+SEND_DELAY = 0.05
+
+# delay between polling rounds while waiting for legs to finish
+POLL_INTERVAL = 0.02
+
+# longest a single action can take (ACTION_HOME is up + full hip swing + down), after this fall back to polling
+DONE_LINE_TIMEOUT = 10
+
+# retries of a failed transaction, waiting RETRY_BACKOFF then doubling before each one
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.005
+
+# failed transactions in a row (after retries) before a leg is marked unavailable
+FAILURE_THRESHOLD = 3
+
+# framed protocol, CMD_FRAME, action | FRAME_STAGE flag, magnitude, speed, sequence number, checksum
+CMD_FRAME = 0x80
+FRAME_STAGE = 0x10
+FRAME_LENGTH = 6
+
+# calibration frame, CMD_CALIBRATE, current hip angle (int16 little endian, tenths), min angle, max angle (int8 degrees), checksum
+# the leg sets its encoder zero so it reads that angle now, and uses the limits for hip moves
+CMD_CALIBRATE = 0x81
+
+# status, done flag (first so a one byte read still works), angle (int16 little endian, tenths), flags, last sequence number, checksum
+STATUS_LENGTH = 6
+STATUS_CONTACT = 0x01
+STATUS_LIMIT = 0x02
+STATUS_FRAME_ERROR = 0x04
+STATUS_HOME_FAILED = 0x08
+STATUS_CALIBRATED = 0x10
+
+# seconds after a frame was sent before a leg that is done on an older sequence number counts as having dropped it
+LOST_FRAME_DELAY = 0.05
+
+# decoded status of one leg
+LegStatus = namedtuple("LegStatus", ("done", "angle", "contact", "limit", "frame_error", "home_failed", "calibrated", "seq"))
+
+# adapter used for any address not assigned to another one
+DEFAULT_ADAPTER = "default"
+
+# seconds before an unavailable leg is probed again, doubles after each failed probe up to MAX_BREAKER_COOLDOWN
+BREAKER_COOLDOWN = 2.0
+MAX_BREAKER_COOLDOWN = 60.0
+
+
+class DeviceUnavailableError(RuntimeError):
+    def __init__(self, address):
+        super().__init__(f"Device {hex(address)} unavailable")
+        self.address = address
+
+
+class DeviceHealth:
+    def __init__(self, address):
+        
+        self.address = address
+        
+        # failed transactions in a row
+        self.failures = 0
+        
+        # open circuit - the leg is unavailable until open_until, then one probe transaction is let through
+        self.is_open = False
+        self.open_until = 0.0
+        self.cooldown = BREAKER_COOLDOWN
+        
+    def allow(self, now):
+        return not self.is_open or now >= self.open_until
+    
+    def recordSuccess(self):
+        if self.is_open:
+            LOG.info("device_recovered", addr=hex(self.address))
+        
+        self.failures = 0
+        self.is_open = False
+        self.cooldown = BREAKER_COOLDOWN
+        
+    def recordFailure(self, now):
+        # returns True if this failure marked the leg unavailable
+        self.failures += 1
+        
+        if self.is_open:
+            # failed probe, wait longer before the next one
+            self.cooldown = min(self.cooldown * 2, MAX_BREAKER_COOLDOWN)
+            self.open_until = now + self.cooldown
+            return False
+        
+        if self.failures >= FAILURE_THRESHOLD:
+            self.is_open = True
+            self.open_until = now + self.cooldown
+            return True
+        
+        return False
+
+
+def checksum(data):
+    # xor of every byte
+    result = 0
+    for byte in data:
+        result ^= byte
+    return result
+
+
+def encodeFrame(action, magnitude=0, speed=0, seq=0, stage=False):
+    """
+    Frame for one leg, magnitude (hip degrees) and speed of 0 use the firmware defaults
+    """
+    
+    if action >= 0x10:
+        raise ValueError(f"Action {action} out of range")
+    
+    frame = [CMD_FRAME, action | (FRAME_STAGE if stage else 0), magnitude & 0xFF, speed & 0xFF, seq & 0xFF]
+    frame.append(checksum(frame))
+    
+    return bytes(frame)
+
+
+def encodeAngle(angle):
+    # int16 little endian tenths of a degree
+    tenths = max(-32768, min(32767, int(round(angle * 10)))) & 0xFFFF
+    return [tenths & 0xFF, tenths >> 8]
+
+
+def decodeAngle(data):
+    return int.from_bytes(bytes(data), "little", signed=True) / 10
+
+
+def encodeCalibration(angle, min_angle, max_angle):
+    """Calibration frame, the leg's encoder is zeroed so it reads angle now and hip moves are kept within min_angle..max_angle"""
+    
+    frame = [CMD_CALIBRATE] + encodeAngle(angle) + [int(round(min_angle)) & 0xFF, int(round(max_angle)) & 0xFF]
+    frame.append(checksum(frame))
+    
+    return bytes(frame)
+
+
+def encodeStatus(done, angle, contact=False, limit=False, frame_error=False, home_failed=False, calibrated=False, seq=0):
+    # what the firmware sends back, used by the emulated legs
+    flags = (STATUS_CONTACT if contact else 0) | (STATUS_LIMIT if limit else 0) | (STATUS_FRAME_ERROR if frame_error else 0) | (STATUS_HOME_FAILED if home_failed else 0) | (STATUS_CALIBRATED if calibrated else 0)
+    
+    status = [1 if done else 0] + encodeAngle(angle) + [flags, seq & 0xFF]
+    status.append(checksum(status))
+    
+    return bytes(status)
+
+
+def decodeStatus(data):
+    """LegStatus from the bytes a leg returned, raises ValueError if they are corrupted"""
+    
+    data = bytes(data)
+    
+    if len(data) != STATUS_LENGTH or checksum(data[:-1]) != data[-1]:
+        raise ValueError(f"Bad status {data.hex()}")
+    
+    return LegStatus(
+        done=data[0] == 1,
+        angle=decodeAngle(data[1:3]),
+        contact=bool(data[3] & STATUS_CONTACT),
+        limit=bool(data[3] & STATUS_LIMIT),
+        frame_error=bool(data[3] & STATUS_FRAME_ERROR),
+        home_failed=bool(data[3] & STATUS_HOME_FAILED),
+        calibrated=bool(data[3] & STATUS_CALIBRATED),
+        seq=data[4],
+    )
+
+
+def writeMessage(address, data):
+    # only import smbus2 when the framed protocol is used
+    from smbus2 import i2c_msg
+    return i2c_msg.write(address, data)
+
+
+def readMessage(address, length):
+    from smbus2 import i2c_msg
+    return i2c_msg.read(address, length)
+
 
 class Instruction:
-    def __init__(self, bus, instructions = Tuple[int, int, int, int, int, int]):
+    def __init__(self, bus, instructions = Tuple[int, int, int, int, int, int], addresses=None):
         
         # single byte defines instructions
         self.bus = bus
         self.instructions = instructions
+        
+        # device addresses matching the order of instructions, defaults to the legs on the bus
+        self.addresses = addresses
 
 
     def sendToLegs(self):
         
-        # names of the legs (match the order of instructions)
-        legs = sorted(self.bus.devices.keys())
-        num = 0
-	
-        # send each to legs if not none
-        for inst in self.instructions:
-            
-            # if testing only one leg
-            if len(legs) == 1:
-                self.bus.devices[legs[num]].sendData(inst)
-                break
-            
-            self.bus.devices[legs[num]].sendData(inst)
-            time.sleep(0.05)
-            
-            num += 1
+        # addresses of the legs (match the order of instructions), cached by the bus
+        addresses = self.addresses if self.addresses is not None else self.bus.leg_addresses
+        
+        with METRICS.time("send_to_legs"):
+            self.bus.dispatch(addresses, self.instructions)
             
     def recallCommand(self):
         
-        legs = sorted(self.bus.devices.keys())
+        legs = self.bus.leg_order
         num = len(legs)
         print("Num devices connected: ", num)
         
-        for i in range(num):
-            cmd = self.bus.devices[legs[i]].readI2C()
+        for device in legs:
+            cmd = device.readI2C()
             
-            print(f"Command sent to {self.bus.devices[legs[i]].name}: {cmd}")
+            print(f"Command sent to {device.name}: {cmd}")
         
             
     def checkFinished(self):
-        print("Checking if done")
+        LOG.debug("check_finished", legs=len(self.bus.devices))
         
-        num_finished = 0
-        
-        while num_finished < len(self.bus.devices.keys()):
-            finished_devices = self.bus.pollArduinos()
-            num_finished += finished_devices
+        with METRICS.time("check_finished"):
+            pending = list(self.bus.devices.values())
+            
+            # block on the shared done line first, then confirm with one poll of each leg
+            if self.bus.done_line is not None:
+                if not self.bus.done_line.waitForDone(DONE_LINE_TIMEOUT):
+                    LOG.warning("done_line_timeout", timeout=DONE_LINE_TIMEOUT)
             
-            print("numfinished", num_finished)
+            # only keep polling legs that haven't reported done yet
+            while pending:
+                pending = self.bus.pollPending(pending)
+                
+                if pending:
+                    if LOG.isEnabled(DEBUG):
+                        LOG.debug("waiting", legs=[device.name for device in pending])
+                    time.sleep(POLL_INTERVAL)
+        
+        LOG.debug("all_finished")
         
-        print("All devices finished")
+        # legs that were given up on instead of finishing
+        return [device.name for device in self.bus.leg_order if not self.bus.isAvailable(device.address)]
 
 class I2CBus:
-    def __init__(self):
-        # i2c 1 port on pi
-        self.bus = smbus2.SMBus(1)
+    def __init__(self, backend=None, broadcast=True, done_line=None, adapters=None, leg_adapters=None, framed=False):
+        """
+        backend - smbus2.SMBus compatible object, defaults to the i2c 1 port on the pi
+        broadcast - use stage-then-commit dispatch, set False for legs running firmware without CMD_GO
+        done_line - optional shared "all done" line (GPIODoneLine), checkFinished waits on it before polling
+        adapters - optional {name: backend} of extra I2C adapters
+        leg_adapters - {address: adapter name} for legs on the extra adapters, every other address uses backend
+        framed - use the framed protocol (backends need smbus2's i2c_rdwr), for legs running firmware with CMD_FRAME
+        """
+        
+        if backend is None:
+            # i2c 1 port on pi, only import smbus2 when talking to the real bus
+            import smbus2
+            backend = smbus2.SMBus(1)
+        
+        self.bus = backend
+        self.broadcast = broadcast
+        self.done_line = done_line
         self.devices = {}
         
+        # adapter name -> backend, and which adapter each leg is on
+        self.adapters = {DEFAULT_ADAPTER: backend}
+        self.adapters.update(adapters or {})
+        self.leg_adapters = dict(leg_adapters or {})
+        
+        for address, name in self.leg_adapters.items():
+            if name not in self.adapters:
+                raise ValueError(f"Device {hex(address)} assigned to unknown adapter {name}")
+        
+        # one thread per adapter, only needed when there is more than one
+        self.workers = {}
+        if len(self.adapters) > 1:
+            self.workers = {name: ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"i2c-{name}") for name in self.adapters}
+        
+        # devices sorted by name and their addresses, this is the order instructions are given in
+        self.leg_order = []
+        self.leg_addresses = ()
+        self.devices_by_address = {}
+        
+        # compiled gait plans for these addresses (see gait_plans.py), cleared when devices change
+        self.plans = None
+        
+        # optional recorder.BusRecorder, every dispatch is recorded when set
+        self.recorder = None
+        
+        # telemetry.Telemetry while it is running, polling then reads the legs' latest samples instead of the bus
+        self.telemetry = None
+        
+        # address -> DeviceHealth, created on first transaction
+        self.health = {}
+        
+        # framed protocol, last sequence number sent to each leg and the last status read from it
+        self.framed = framed
+        self.seq = {}
+        self.status = {}
+        
+        # address -> the last frame sent to the leg, resent once if the leg drops it
+        self.sent = {}
+        
     def addDevices(self, *devices):
         # add inos to devices list
         for device in devices:
             if isinstance(device, GMTIno):
                 device.bus = self
                 self.devices[device.name] = device
+        
+        self.leg_order = [self.devices[name] for name in sorted(self.devices.keys())]
+        self.leg_addresses = tuple(device.address for device in self.leg_order)
+        self.devices_by_address = {device.address: device for device in self.leg_order}
+        self.plans = None
+    
+    def adapterFor(self, address):
+        return self.leg_adapters.get(address, DEFAULT_ADAPTER)
+    
+    def byAdapter(self, items, address=lambda item: item):
+        # group items by the adapter of their address, keeping their order
+        groups = {}
+        
+        for item in items:
+            groups.setdefault(self.adapterFor(address(item)), []).append(item)
+        
+        return groups
+    
+    def onAdapters(self, groups, fn):
+        # run fn(adapter, items) for each adapter, in parallel on the adapter threads when there is more than one
+        if len(groups) <= 1 or not self.workers:
+            return [fn(name, items) for name, items in groups.items()]
+        
+        futures = [self.workers[name].submit(fn, name, items) for name, items in groups.items()]
+        return [future.result() for future in futures]
+    
+    def dispatch(self, addresses, actions, magnitudes=None, speeds=None):
+        # send one action to each address, actions[i] goes to addresses[i], unavailable legs are skipped
+        # magnitudes/speeds are only sent with the framed protocol
+        if LOG.isEnabled(DEBUG):
+            LOG.debug("dispatch", addrs=[hex(address) for address in addresses], actions=list(actions))
+        
+        if self.recorder is not None:
+            self.recorder.recordDispatch(addresses, actions)
+        
+        if self.framed:
+            magnitudes = magnitudes or [0] * len(addresses)
+            speeds = speeds or [0] * len(addresses)
+            
+            # a single leg starts straight away, several are staged and started with GO
+            stage = self.broadcast and len(addresses) > 1
+            groups = self.byAdapter(zip(addresses, actions, magnitudes, speeds), lambda leg: leg[0])
+            self.onAdapters(groups, lambda adapter, legs: self.dispatchFramesOnAdapter(adapter, legs, stage))
+            return
+        
+        # if testing only one leg
+        if len(addresses) == 1:
+            self.sendToLeg(addresses[0], actions[0])
+            return
+        
+        groups = self.byAdapter(zip(addresses, actions), lambda pair: pair[0])
+        self.onAdapters(groups, self.dispatchOnAdapter)
+        
+    def dispatchOnAdapter(self, adapter, pairs):
+        if self.broadcast:
+            # stage every leg, then start them together with one general call
+            for address, action in pairs:
+                self.sendToLeg(address, CMD_STAGE | action)
+            
+            if not self.broadcastGo(adapter):
+                # start them one at a time instead, a direct action also clears the staged one
+                for address, action in pairs:
+                    self.sendToLeg(address, action)
+            return
+        
+        # send each to legs one at a time
+        for address, action in pairs:
+            self.sendToLeg(address, action)
+            time.sleep(SEND_DELAY)
+            
+    def nextSeq(self, address):
+        self.seq[address] = (self.seq.get(address, 0) + 1) & 0xFF
+        return self.seq[address]
+    
+    def frameFor(self, address, action, magnitude=0, speed=0, stage=False):
+        # next frame for a leg, kept so it can be resent if the leg drops it
+        seq = self.nextSeq(address)
+        self.sent[address] = {"action": action, "magnitude": magnitude, "speed": speed, "seq": seq, "time": time.monotonic(), "resent": False}
+        
+        return encodeFrame(action, magnitude, speed, seq, stage)
+    
+    def checkLostFrame(self, device, seq, read_at):
+        """
+        For a leg that is done on sequence number seq (read at monotonic time read_at) while a newer frame was sent to it. The first time the frame is resent unstaged, returns True once that was tried too and polling should stop waiting for the leg
+        """
+        
+        sent = self.sent.get(device.address)
+        
+        if sent is None or read_at - sent["time"] < LOST_FRAME_DELAY:
+            return False
+        
+        if sent["resent"]:
+            LOG.error("frame_lost", leg=device.name, addr=hex(device.address), seq=seq, expected=sent["seq"], resent=True)
+            del self.sent[device.address]
+            return True
+        
+        LOG.warning("frame_lost", leg=device.name, addr=hex(device.address), seq=seq, expected=sent["seq"])
+        METRICS.count("i2c_frames_lost_total", addr=hex(device.address))
+        
+        sent["resent"] = True
+        sent["time"] = time.monotonic()
+        
+        try:
+            self.WriteFrame(device.address, encodeFrame(sent["action"], sent["magnitude"], sent["speed"], sent["seq"]))
+        except (OSError, DeviceUnavailableError) as e:
+            LOG.error("send_failed", addr=hex(device.address), error=str(e))
+        
+        return False
+    
+    def dispatchFramesOnAdapter(self, adapter, legs, stage):
+        # every frame, and the GO, in one transfer
+        frames = [(address, self.frameFor(address, action, magnitude, speed, stage)) for address, action, magnitude, speed in legs if self.isAvailable(address)]
+        messages = [writeMessage(address, frame) for address, frame in frames]
+        
+        if stage:
+            messages.append(writeMessage(GENERAL_CALL_ADDRESS, [CMD_GO]))
+        
+        try:
+            self.Batch(adapter, messages)
+            return
+        
+        except OSError as e:
+            # one leg not acking fails the whole transfer, redo it leg by leg so only that leg is retried
+            LOG.warning("batch_failed", adapter=adapter, error=str(e))
+        
+        for address, frame in frames:
+            try:
+                self.WriteFrame(address, frame)
+            except (OSError, DeviceUnavailableError) as e:
+                LOG.error("send_failed", addr=hex(address), frame=frame.hex(), error=str(e))
+        
+        if stage and not self.broadcastGo(adapter):
+            self.startUnstaged(frames)
+    
+    def startUnstaged(self, frames):
+        # the GO after staged frames failed, send each leg its frame again without FRAME_STAGE so it starts (and drops the staged one)
+        for address, _ in frames:
+            sent = self.sent[address]
+            
+            try:
+                self.WriteFrame(address, encodeFrame(sent["action"], sent["magnitude"], sent["speed"], sent["seq"]))
+            except (OSError, DeviceUnavailableError) as e:
+                LOG.error("send_failed", addr=hex(address), error=str(e))
+    
+    def sendToLeg(self, address, data):
+        # one leg failing doesn't stop the others from getting their action
+        try:
+            self.WriteByte(address, data)
+        except (OSError, DeviceUnavailableError) as e:
+            LOG.error("send_failed", addr=hex(address), data=data, error=str(e))
                 
     def pollSingleLeg(self, device):
         
         try:
+            if self.framed:
+                status = device.readStatus()
+                return self.isFinished(device.address, status) or (status.done and self.checkLostFrame(device, status.seq, time.monotonic()))
+            
             response = device.readI2C()
-            print(f"response: {response} from device name {device.name}")
+            LOG.debug("poll", leg=device.name, response=response)
             
             if response == 1:
-                print("device finished moving")
                 return True
             
-        except OSError as e:
-            print(f"Failed to poll device {hex(device.address)}: {e}")
+        except (OSError, ValueError) as e:
+            LOG.error("poll_failed", addr=hex(device.address), error=str(e))
+            
+    def isFinished(self, address, status):
+        # done, and done with the last frame sent rather than the one before
+        LOG.debug("status", addr=hex(address), done=status.done, seq=status.seq)
+        return status.done and status.seq == self.seq.get(address, status.seq)
 
 
+    def pollPending(self, devices):
+        # poll each device once, returns the ones that are still moving, unavailable legs are dropped
+        pending = []
+        
+        if self.telemetry is not None:
+            # done with the last frame sent, as of the latest telemetry sample
+            for device in devices:
+                if not self.isAvailable(device.address) or self.telemetry.isFinished(device.address, self.seq.get(device.address)):
+                    continue
+                
+                sample = self.telemetry.latest(device.address)
+                
+                if sample is not None and sample["done"] and self.checkLostFrame(device, int(sample["seq"]), sample["t"]):
+                    continue
+                
+                pending.append(device)
+            
+            return pending
+        
+        with METRICS.time("poll_pending"):
+            groups = self.byAdapter(devices, lambda device: device.address)
+            
+            for still_pending in self.onAdapters(groups, self.pollOnAdapter):
+                pending.extend(still_pending)
+        
+        return pending
+    
+    def pollOnAdapter(self, adapter, devices):
+        if self.framed:
+            return self.pollStatusOnAdapter(adapter, devices)
+        
+        pending = []
+        
+        for device in devices:
+            try:
+                if not self.pollSingleLeg(device):
+                    pending.append(device)
+            
+            except DeviceUnavailableError:
+                LOG.error("leg_unavailable", leg=device.name, addr=hex(device.address))
+        
+        return pending
+
+    def pollStatusOnAdapter(self, adapter, devices):
+        pending = []
+        
+        for device, status in self.readStatusOnAdapter(adapter, devices).items():
+            # status is None if the leg answered but the read failed, poll it again
+            if status is not None and (self.isFinished(device.address, status) or (status.done and self.checkLostFrame(device, status.seq, time.monotonic()))):
+                continue
+            
+            pending.append(device)
+        
+        return pending
+    
+    def readStatuses(self, devices=None):
+        """Framed protocol, reads the status of every device (default all) in one transfer per adapter, returns {address: LegStatus} for the legs that answered"""
+        
+        devices = list(self.devices.values()) if devices is None else devices
+        statuses = {}
+        
+        groups = self.byAdapter(devices, lambda device: device.address)
+        for result in self.onAdapters(groups, self.readStatusOnAdapter):
+            statuses.update({device.address: status for device, status in result.items() if status is not None})
+        
+        return statuses
+    
+    def readStatusOnAdapter(self, adapter, devices):
+        # read every available leg's status in one transfer, returns {device: LegStatus or None if the read failed}, unavailable legs are left out
+        available = []
+        
+        for device in devices:
+            if self.healthFor(device.address).allow(time.monotonic()):
+                available.append(device)
+            else:
+                LOG.error("leg_unavailable", leg=device.name, addr=hex(device.address))
+        
+        messages = [readMessage(device.address, STATUS_LENGTH) for device in available]
+        statuses = {}
+        
+        try:
+            self.Batch(adapter, messages)
+        
+        except OSError as e:
+            # find the leg that failed by reading one at a time
+            LOG.warning("batch_failed", adapter=adapter, error=str(e))
+            
+            for device in available:
+                try:
+                    statuses[device] = device.readStatus()
+                
+                except DeviceUnavailableError:
+                    LOG.error("leg_unavailable", leg=device.name, addr=hex(device.address))
+                
+                except (OSError, ValueError) as e:
+                    LOG.error("poll_failed", addr=hex(device.address), error=str(e))
+                    statuses[device] = None
+            
+            return statuses
+        
+        for device, message in zip(available, messages):
+            self.healthFor(device.address).recordSuccess()
+            
+            try:
+                statuses[device] = self.status[device.address] = decodeStatus(bytes(message))
+            except ValueError as e:
+                LOG.error("poll_failed", addr=hex(device.address), error=str(e))
+                statuses[device] = None
+        
+        return statuses
+
     def pollArduinos(self):
         # poll all arduinos on the bus to check their status
         # arduinos can send a true/false determining whether or not they complete instruction
         # each ino sends 1 (if the instruction is finished)
         
         finished_devices = 0
+        start = time.perf_counter()
         
         for device in self.devices.values():
 
             try:
                 response = device.readI2C()
-                print(f"response: {response}")
+                LOG.debug("poll", leg=device.name, response=response)
                 
                 if response == 1:
                     finished_devices += 1
-                    print(f"{device.name} address {device.address} finished")
                 
             # check for issues with connectivity
-            except OSError as e:
-                print(f"Failed to poll device {hex(device.address)}: {e}")
+            except (OSError, DeviceUnavailableError) as e:
+                LOG.error("poll_failed", addr=hex(device.address), error=str(e))
                 # break
             
             time.sleep(0.02)
+        
+        METRICS.observe("poll_arduinos", time.perf_counter() - start)
     
         return finished_devices
     
-    def WriteByte(self, address, data):
-        self.bus.write_byte(address, data)
+    def broadcastGo(self, adapter=DEFAULT_ADAPTER):
+        # general call, every leg on the adapter with a staged action starts it, returns False if it failed
+        # retried but kept out of the circuit breakers, 0x00 isn't a leg and a failed GO shouldn't abort the dispatch
+        backend = self.adapters[adapter]
+        
+        try:
+            self.retry(GENERAL_CALL_ADDRESS, "write", backend.write_byte, CMD_GO)
+            return True
+        
+        except OSError as e:
+            LOG.error("go_failed", adapter=adapter, error=str(e))
+            return False
+    
+    def healthFor(self, address):
+        # setdefault so adapter threads never create two for one address
+        health = self.health.get(address)
+        
+        if health is None:
+            health = self.health.setdefault(address, DeviceHealth(address))
+        
+        return health
+    
+    def isAvailable(self, address):
+        health = self.health.get(address)
+        return health is None or not health.is_open
+    
+    def unavailableAddresses(self):
+        return [address for address, health in self.health.items() if health.is_open]
+    
+    def transfer(self, address, op, fn, *args):
+        # run one transaction with retries, backoff and the address's circuit breaker
+        health = self.healthFor(address)
+        
+        if not health.allow(time.monotonic()):
+            raise DeviceUnavailableError(address)
+        
+        # an unavailable leg only gets a single probe
+        attempts = 1 if health.is_open else 1 + MAX_RETRIES
+        
+        try:
+            result = self.retry(address, op, fn, *args, attempts=attempts)
+        
+        except OSError as error:
+            if health.recordFailure(time.monotonic()):
+                LOG.error("device_unavailable", addr=hex(address), failures=health.failures, error=str(error))
+                METRICS.count("i2c_unavailable_total", addr=hex(address))
+            
+            raise
+        
+        health.recordSuccess()
+        return result
+    
+    def retry(self, address, op, fn, *args, attempts=1 + MAX_RETRIES):
+        # run one transaction with retries and backoff, raises the last error if every attempt fails
+        for attempt in range(attempts):
+            start = time.perf_counter()
+            
+            try:
+                result = fn(address, *args)
+            
+            except OSError as e:
+                METRICS.count("i2c_errors_total", addr=hex(address), op=op)
+                error = e
+                
+                if attempt + 1 < attempts:
+                    METRICS.count("i2c_retries_total", addr=hex(address), op=op)
+                    time.sleep(RETRY_BACKOFF * 2 ** attempt)
+                
+                continue
+            
+            METRICS.observe(f"i2c_{op}", time.perf_counter() - start, addr=hex(address))
+            return result
+        
+        raise error
+    
+    def probe(self):
+        """Addresses of the legs that answer a status read, every leg is tried at once so missing legs' retries overlap"""
+        
+        def answers(device):
+            try:
+                if self.framed:
+                    self.ReadStatus(device.address)
+                else:
+                    self.ReadByte(device.address)
+                return True
+            
+            except (OSError, ValueError, DeviceUnavailableError) as e:
+                LOG.warning("probe_failed", leg=device.name, addr=hex(device.address), error=str(e))
+                return False
+        
+        with METRICS.time("probe"), ThreadPoolExecutor(max_workers=max(len(self.leg_order), 1), thread_name_prefix="probe") as pool:
+            answered = list(pool.map(answers, self.leg_order))
+        
+        return [device.address for device, ok in zip(self.leg_order, answered) if ok]
+    
+    def WriteByte(self, address, data, adapter=None):
+        # adapter only needs giving for the general call address, legs are looked up
+        backend = self.adapters[adapter or self.adapterFor(address)]
+        self.transfer(address, "write", backend.write_byte, data)
         
     def ReadByte(self, address):
-        return self.bus.read_byte(address)
+        backend = self.adapters[self.adapterFor(address)]
+        return self.transfer(address, "read", backend.read_byte)
+    
+    def WriteFrame(self, address, frame):
+        backend = self.adapters[self.adapterFor(address)]
+        self.transfer(address, "write", lambda address, frame: backend.i2c_rdwr(writeMessage(address, frame)), frame)
+        
+    def ReadStatus(self, address):
+        # one block read of the leg's status
+        backend = self.adapters[self.adapterFor(address)]
+        
+        def read(address):
+            message = readMessage(address, STATUS_LENGTH)
+            backend.i2c_rdwr(message)
+            return bytes(message)
+        
+        status = self.status[address] = decodeStatus(self.transfer(address, "read", read))
+        return status
+    
+    def Batch(self, adapter, messages):
+        # several messages (any mix of legs, reads and writes) in one i2c_rdwr transfer on an adapter
+        if not messages:
+            return
+        
+        start = time.perf_counter()
+        
+        try:
+            self.adapters[adapter].i2c_rdwr(*messages)
+        except OSError:
+            METRICS.count("i2c_errors_total", adapter=adapter, op="batch")
+            raise
+        
+        METRICS.observe("i2c_batch", time.perf_counter() - start, adapter=adapter)
+    
+    def close(self):
+        for worker in self.workers.values():
+            worker.shutdown()
+    
+def openAdapters(spec):
+    """
+    Extra adapters from a spec like "3=0x13,0x14,0x15;4=0x16" (i2c bus number = leg addresses), returns (adapters, leg_adapters) for I2CBus
+    """
+    
+    import smbus2
+    
+    adapters = {}
+    leg_adapters = {}
+    
+    for entry in filter(None, spec.split(";")):
+        number, addresses = entry.split("=")
+        name = f"i2c-{int(number)}"
+        adapters[name] = smbus2.SMBus(int(number))
+        
+        for address in addresses.split(","):
+            leg_adapters[int(address, 0)] = name
+    
+    return adapters, leg_adapters
+    
+
+class GPIODoneLine:
+    def __init__(self, pin, pull_up=True):
+        """
+        Shared open-drain line on a Pi GPIO. Every leg holds it low while it has an action staged or running, so the line only goes high once all legs are done.
+        """
+        
+        # only needed on the pi
+        from gpiozero import DigitalInputDevice
+        
+        # active while any leg is pulling the line low
+        self.line = DigitalInputDevice(pin, pull_up=pull_up)
+        
+    def waitForDone(self, timeout=None):
+        # returns False if the line was still held low after timeout
+        return self.line.wait_for_inactive(timeout)
+    
+    def close(self):
+        self.line.close()
+    
     
 class GMTIno:
     def __init__(self, name, address):
@@ -131,19 +830,50 @@ class GMTIno:
         self.bus = None
         
     def sendData(self, data):
-        print(f"Sending data: {data} to Arduino: {self.name} at address: {hex(self.address)}")
+        LOG.debug("send", leg=self.name, addr=hex(self.address), data=data)
         
         if self.bus is None:
             raise RuntimeError(f"Device {hex(self.address)} not added to I2C bus")
         
         self.bus.WriteByte(self.address, data)
         
+    def stageData(self, data):
+        # action is held by the leg until the next broadcastGo
+        if self.bus is None:
+            raise RuntimeError(f"Device {hex(self.address)} not added to I2C bus")
+        
+        if data >= 0x10:
+            raise ValueError(f"Action {data} out of range for device {hex(self.address)}")
+        
+        self.bus.WriteByte(self.address, CMD_STAGE | data)
+        
     def readI2C(self):
         if self.bus is None:
             raise RuntimeError(f"Device {hex(self.address)} not added to I2C bus")
         
-        print("READING FROM address", self.address)
+        LOG.debug("read", leg=self.name, addr=hex(self.address))
         return self.bus.ReadByte(self.address)
+    
+    def sendFrame(self, action, magnitude=0, speed=0):
+        # framed protocol, starts straight away
+        if self.bus is None:
+            raise RuntimeError(f"Device {hex(self.address)} not added to I2C bus")
+        
+        self.bus.WriteFrame(self.address, self.bus.frameFor(self.address, action, magnitude, speed))
+        
+    def sendCalibration(self, angle, min_angle, max_angle):
+        # framed protocol, tell the leg it is at angle now and its hip limits
+        if self.bus is None:
+            raise RuntimeError(f"Device {hex(self.address)} not added to I2C bus")
+        
+        self.bus.WriteFrame(self.address, encodeCalibration(angle, min_angle, max_angle))
+        
+    def readStatus(self):
+        # framed protocol, LegStatus with the done flag, angle, contact, limit switch and last sequence number
+        if self.bus is None:
+            raise RuntimeError(f"Device {hex(self.address)} not added to I2C bus")
+        
+        return self.bus.ReadStatus(self.address)
         
     
 def testI2C(bus):
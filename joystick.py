@@ -1,34 +1,75 @@
 import pygame
+import queue
+import threading
 import time
+from collections import namedtuple
 
 """
 Joystick-specific functions for initialization and monitoring. Uses the pygame class to get specific inputs.
 NOTE - switched to the dpad for controls, easier to implement
+
+GMTJoystick samples the controller on its own thread every SAMPLE_INTERVAL. Each sample is published as an immutable Controls snapshot, so getControls is a constant time read that never touches pygame, and every button press is put on a queue (getPresses) so presses aren't lost while the caller is busy with a gait.
 """
 
-class GMTJoystick:
+# seconds between controller samples on the input thread
+SAMPLE_INTERVAL = 0.005
+
+# seconds between checks for a controller while waiting for one
+CONNECT_INTERVAL = 0.05
+
+# latest controller state, unpacks the same as the old getControls tuple
+Controls = namedtuple("Controls", ("x", "y", "a_btn", "y_btn", "b_btn", "x_btn", "left_joy"))
+
+# pygame button index -> name used for presses
+BUTTON_NAMES = {0: "a", 1: "b", 2: "x", 3: "y", 9: "left_joy"}
+
+
+class NoControllerError(RuntimeError):
     def __init__(self):
+        super().__init__("Stopped waiting for a controller")
+
+
+class GMTJoystick:
+    def __init__(self, sample_interval=SAMPLE_INTERVAL, stop=None):
+        """
+        stop - optional threading.Event, waiting for the controller raises NoControllerError once it is set
+        """
         
-        pygame.init()
+        # only what the controller needs (the event queue comes with the display), no audio or fonts
+        pygame.display.init()
         pygame.joystick.init()
         
         # check for connection to xbox controller
-        self.j = self.tryConnection()
+        self.j = self.tryConnection(stop)
         self.j.init()
         
         print(f"Controller: {self.j.get_name()}")
         self.connected = True
         
-    def tryConnection(self):
+        # latest snapshot, replaced (never modified) by the input thread
+        self.latest = None
+        
+        # names of buttons pressed since the last getPresses
+        self.presses = queue.SimpleQueue()
+        
+        # first snapshot before anyone can ask for it
+        self.sample()
+        
+        self.sample_interval = sample_interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sampleLoop, name="joystick", daemon=True)
+        self.thread.start()
+        
+    def tryConnection(self, stop=None):
         
         """ Continually try reconnecting until joystick is added """
         
         print("Finding controller")
         
+        waiting = False
+        
         while True:
             
-            print("no controller")
-            
             for event in pygame.event.get():
                 
                 # check whether a joystick was added
@@ -41,40 +82,68 @@ class GMTJoystick:
                     
                     return joy
 
-            time.sleep(1)
-                
-    
-    def getControls(self):
-        # returns controls
-            
-        if not self.connected:
-            return None
+            if not waiting:
+                print("no controller")
+                waiting = True
 
-        try:
-            pygame.event.pump()
-            
-            for event in pygame.event.get():
-                if event.type == pygame.JOYBUTTONDOWN:
-                    print(f"Button pressed: {event.button}")
-
-            dpad = self.j.get_hat(0)
-            a_btn = bool(self.j.get_button(0))
-            y_btn = bool(self.j.get_button(3))
-            b_btn = bool(self.j.get_button(1))
-            x_btn = bool(self.j.get_button(2))
+            if stop is not None and stop.is_set():
+                raise NoControllerError()
+
+            time.sleep(CONNECT_INTERVAL)
             
-            x = dpad[0]   # -1 = left, 0 = neutral, 1 = right
-            y = dpad[1]   # -1 = down, 0 = neutral, 1 = up
+    def sample(self):
+        # read the controller once, queue any button presses and publish a new snapshot
+        for event in pygame.event.get():
+            if event.type == pygame.JOYBUTTONDOWN and event.button in BUTTON_NAMES:
+                self.presses.put(BUTTON_NAMES[event.button])
+
+        dpad = self.j.get_hat(0)
+        
+        self.latest = Controls(
+            x=dpad[0],   # -1 = left, 0 = neutral, 1 = right
+            y=dpad[1],   # -1 = down, 0 = neutral, 1 = up
+            a_btn=bool(self.j.get_button(0)),
+            y_btn=bool(self.j.get_button(3)),
+            b_btn=bool(self.j.get_button(1)),
+            x_btn=bool(self.j.get_button(2)),
+            left_joy=bool(self.j.get_button(9)),
+        )
+        
+    def sampleLoop(self):
+        while not self.stopped.is_set():
             
-            left_joystick_press = bool(self.j.get_button(9))
+            try:
+                self.sample()
+                
+            except Exception as e:
+                self.connected = False
+                self.j = None
+                self.latest = None
+                print(f"Err: {e}")
+                return
             
-            return (x, y, a_btn, y_btn, b_btn, x_btn, left_joystick_press)
-
-        except Exception as e:
-            self.connected = False
-            self.j = None
-            print(f"Err: {e}")
+            time.sleep(self.sample_interval)
+                
+    def getControls(self):
+        # latest Controls snapshot, None if the controller is disconnected or not sampled yet
+        if not self.connected:
             return None
+        
+        return self.latest
+    
+    def getPresses(self):
+        # button names pressed since the last call, in order
+        presses = []
+        
+        while True:
+            try:
+                presses.append(self.presses.get_nowait())
+            except queue.Empty:
+                return presses
+            
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
             
     
 ######################################################
@@ -26,6 +26,10 @@
 #define LIMIT_PIN 12
 #define FLOOR_CONTACT_PIN A0
 
+// shared open-drain "all done" line to the Pi, pulled low while an action is staged or running
+// never driven high, the Pi side pulls it up to 3.3V
+#define DONE_LINE_PIN A1
+
 #define MOTOR_SPEED 175
 #define HIP_MOVE_INTERVAL 20
 #define HIP_HOME_INTERVAL 5
@@ -35,6 +39,11 @@
 #define PRINT_INTERVAL 500
 #define HOMING_THRESHOLD 1
 
+// auto homing: the limit switch closes at the end of travel reached with set_backward, home is LIMIT_OFFSET degrees from it
+#define HOMING_SPEED 90
+#define LIMIT_OFFSET 30
+#define AUTO_HOME_TIMEOUT ((2 * MAX_ANGLE + LIMIT_OFFSET) * STEP_MAX_TIME_CONSTANT * 2)
+
 #define NOT_DONE 0
 #define DONE 1
 
@@ -47,6 +56,32 @@
 #define ACTION_HOME_BACKWARD 6
 #define ACTION_ZERO 7
 #define ACTION_HOME 8
+#define ACTION_AUTO_HOME 9
+
+// stage-then-commit dispatch: CMD_STAGE | action is held until a general call CMD_GO starts it
+#define CMD_STAGE 0x20
+#define CMD_GO 0x40
+
+// framed protocol: CMD_FRAME, action | FRAME_STAGE, magnitude (hip degrees, 0 = default), speed (0 = MOTOR_SPEED), seq, xor checksum
+#define CMD_FRAME 0x80
+#define FRAME_STAGE 0x10
+#define FRAME_LENGTH 6
+
+// status: done, angle (int16 little endian, tenths of a degree), flags, last seq, xor checksum
+// done comes first so a single byte read still gets the old status
+// calibration: CMD_CALIBRATE, current angle (int16 little endian, tenths), min angle, max angle (int8 degrees), xor checksum
+// zeroes the encoder so it reads that angle now and sets the hip limits, sent by the Pi after a power cycle
+#define CMD_CALIBRATE 0x81
+
+#define STATUS_LENGTH 6
+#define STATUS_CONTACT 0x01
+#define STATUS_LIMIT 0x02
+#define STATUS_FRAME_ERROR 0x04
+#define STATUS_HOME_FAILED 0x08
+#define STATUS_CALIBRATED 0x10
+
+// angle and sensor flags are sampled in loop/the move loops, the I2C request handler only copies them
+#define STATUS_INTERVAL 10
 
 #if INO_ADDRESS == 0x10 || INO_ADDRESS == 0x11
   SoftwareSerial RS485_serial(RX_RS485, TX_RS485);
@@ -61,7 +96,27 @@ ModbusMaster node;
 
 bool forward = true;
 unsigned long last_print = 0;
-unsigned char current_action = ACTION_NONE;
+volatile unsigned char current_action = ACTION_NONE;
+volatile unsigned char staged_action = ACTION_NONE;
+volatile bool has_staged = false;
+volatile unsigned char current_magnitude = 0;
+volatile unsigned char current_speed = 0;
+volatile unsigned char staged_magnitude = 0;
+volatile unsigned char staged_speed = 0;
+volatile unsigned char staged_seq = 0;
+volatile unsigned char last_seq = 0;
+volatile bool frame_error = false;
+volatile bool home_failed = false;
+
+// encoder zeroed since power on, and a calibration frame waiting to be applied by loop()
+volatile bool calibrated = false;
+volatile bool has_calibration = false;
+volatile int calibration_angle = 0;
+volatile signed char calibration_min = -MAX_ANGLE;
+volatile signed char calibration_max = MAX_ANGLE;
+volatile int status_angle = 0;
+volatile unsigned char status_flags = 0;
+unsigned long last_status = 0;
 float zero_offset = 0;
 float min_angle = -MAX_ANGLE;
 float max_angle = MAX_ANGLE;
@@ -96,7 +151,7 @@ float get_angle() {
 }
 
 void set_motor_speed() {
-  uint8_t result = node.writeSingleRegister(0x8005, MOTOR_SPEED);
+  uint8_t result = node.writeSingleRegister(0x8005, current_speed ? current_speed : MOTOR_SPEED);
   Serial.print("set motor speed result: ");
   Serial.println(result);
 }
@@ -109,6 +164,22 @@ bool is_hitting_limit() {
   return !digitalRead(LIMIT_PIN);
 }
 
+void update_status() {
+  if (millis() - last_status < STATUS_INTERVAL)
+    return;
+  last_status = millis();
+
+  int angle = (int)(get_angle() * 10);
+  unsigned char flags = 0;
+  if (is_contacting_ground()) flags |= STATUS_CONTACT;
+  if (is_hitting_limit()) flags |= STATUS_LIMIT;
+
+  noInterrupts();
+  status_angle = angle;
+  status_flags = flags;
+  interrupts();
+}
+
 void braking_stop() {
   Serial.println("braking stop (NOT RECOMMENDED)");
   setMotorState(0,0,1);
@@ -137,6 +208,7 @@ void step_down() {
     // if (is_contacting_ground())
     //   break;
     encoder.update();
+    update_status();
     digitalWrite(PUL_PIN, LOW);
     delayMicroseconds(1000);
     digitalWrite(PUL_PIN, HIGH);
@@ -152,6 +224,7 @@ void step_up() {
   digitalWrite(EN_PIN, LOW);
   for (int i = 0; i < STEP_UP_ITERS; i++) {
     encoder.update();
+    update_status();
     digitalWrite(PUL_PIN, LOW);
     delayMicroseconds(1000);
     digitalWrite(PUL_PIN, HIGH);
@@ -181,6 +254,7 @@ void move_forward(float angle) {
 
   while (current_action != ACTION_NONE && get_angle() < end_condition && get_angle() < max_angle) {
     encoder.update();
+    update_status();
 
     if (millis() - step_time > max_time) {
       Serial.print("step timeout breaking...");
@@ -222,6 +296,7 @@ void move_backward(float angle) {
 
   while (current_action != ACTION_NONE && get_angle() > end_condition && get_angle() > min_angle) {
     encoder.update();
+    update_status();
 
     if (millis() - step_time > max_time) {
       Serial.println(millis() - step_time);
@@ -264,6 +339,7 @@ void handle_backward(int angle) {
 
 void zero_encoder() {
   zero_offset = encoder.getAngle();
+  calibrated = true;
   Serial.print("zeroed encoder: ");
   Serial.println(zero_offset);
   Serial.print("current_angle");
@@ -283,21 +359,208 @@ move_up();
   move_down();
 }
 
+void auto_home() {
+  move_up();
+
+  // seek the switch slowly, the encoder isn't zeroed yet so there are no angle limits
+  unsigned char speed = current_speed;
+  current_speed = HOMING_SPEED;
+  set_backward();
+
+  unsigned long start = millis();
+  while (current_action != ACTION_NONE && !is_hitting_limit() && millis() - start < AUTO_HOME_TIMEOUT) {
+    encoder.update();
+    update_status();
+  }
+  non_braking_stop();
+  current_speed = speed;
+
+  if (!is_hitting_limit()) {
+    Serial.println("limit switch not found");
+    home_failed = true;
+    move_down();
+    return;
+  }
+
+  // back off to home and zero there
+  float limit_angle = encoder.getAngle();
+  set_forward();
+
+  start = millis();
+  while (current_action != ACTION_NONE && encoder.getAngle() - limit_angle < LIMIT_OFFSET && millis() - start < AUTO_HOME_TIMEOUT) {
+    encoder.update();
+    update_status();
+  }
+  non_braking_stop();
+
+  zero_encoder();
+  home_failed = false;
+  move_down();
+}
+
+void hold_done_line() {
+  digitalWrite(DONE_LINE_PIN, LOW);
+  pinMode(DONE_LINE_PIN, OUTPUT);
+}
+
+void release_done_line() {
+  pinMode(DONE_LINE_PIN, INPUT);
+}
+
+unsigned char checksum(unsigned char *data, int length) {
+  unsigned char result = 0;
+  for (int i = 0; i < length; i++)
+    result ^= data[i];
+  return result;
+}
+
+// a command that arrives while an action is running is rejected and last_seq keeps the running frame's number, so the Pi sees the command was lost (ACTION_NONE still stops a hip move)
+void set_action(unsigned char action, unsigned char magnitude, unsigned char speed, unsigned char seq) {
+  if (current_action != ACTION_NONE && action != ACTION_NONE)
+    return;
+
+  current_magnitude = magnitude;
+  current_speed = speed;
+  last_seq = seq;
+  current_action = action;
+  if (current_action != ACTION_NONE)
+    hold_done_line();
+}
+
+void receiveFrame() {
+  unsigned char frame[FRAME_LENGTH];
+  int count = 0;
+
+  while (Wire.available()) {
+    unsigned char byte = Wire.read();
+    if (count < FRAME_LENGTH)
+      frame[count] = byte;
+    count++;
+  }
+
+  // corrupted frames are dropped and flagged in the status
+  if (count != FRAME_LENGTH || checksum(frame, FRAME_LENGTH - 1) != frame[FRAME_LENGTH - 1]) {
+    frame_error = true;
+    return;
+  }
+  frame_error = false;
+
+  if (frame[1] & FRAME_STAGE) {
+    staged_action = frame[1] & 0x0F;
+    staged_magnitude = frame[2];
+    staged_speed = frame[3];
+    staged_seq = frame[4];
+    has_staged = true;
+    if (staged_action != ACTION_NONE)
+      hold_done_line();
+    return;
+  }
+
+  // a direct command replaces whatever was staged, so a later GO can't start it
+  has_staged = false;
+  set_action(frame[1] & 0x0F, frame[2], frame[3], frame[4]);
+}
+
+void receiveCalibration() {
+  unsigned char frame[FRAME_LENGTH];
+  int count = 0;
+
+  while (Wire.available()) {
+    unsigned char byte = Wire.read();
+    if (count < FRAME_LENGTH)
+      frame[count] = byte;
+    count++;
+  }
+
+  if (count != FRAME_LENGTH || checksum(frame, FRAME_LENGTH - 1) != frame[FRAME_LENGTH - 1]) {
+    frame_error = true;
+    return;
+  }
+  frame_error = false;
+
+  calibration_angle = (int16_t)(frame[1] | (frame[2] << 8));
+  calibration_min = (signed char)frame[3];
+  calibration_max = (signed char)frame[4];
+  has_calibration = true;
+}
+
+void apply_calibration() {
+  noInterrupts();
+  float angle = calibration_angle / 10.0;
+  min_angle = calibration_min;
+  max_angle = calibration_max;
+  has_calibration = false;
+  interrupts();
+
+  zero_offset = encoder.getAngle() - angle;
+  calibrated = true;
+
+  // status reflects the new zero straight away
+  last_status = millis() - STATUS_INTERVAL;
+  update_status();
+
+  Serial.print("calibrated, angle: ");
+  Serial.println(get_angle());
+}
+
 void receiveCommand(int numBytes) {
+  if (Wire.peek() == CMD_FRAME) {
+    receiveFrame();
+    return;
+  }
+
+  if (Wire.peek() == CMD_CALIBRATE) {
+    receiveCalibration();
+    return;
+  }
+
   while (Wire.available()) {
     unsigned char byte = Wire.read();
+
+    // general call from the Pi, start whatever was staged
+    if (byte == CMD_GO) {
+      if (has_staged) {
+        set_action(staged_action, staged_magnitude, staged_speed, staged_seq);
+        has_staged = false;
+      }
+      continue;
+    }
+
+    if ((byte & 0xF0) == CMD_STAGE) {
+      staged_action = byte & 0x0F;
+      staged_magnitude = 0;
+      staged_speed = 0;
+      staged_seq = last_seq;
+      has_staged = true;
+      if (staged_action != ACTION_NONE)
+        hold_done_line();
+      continue;
+    }
+
     if (byte >= 0x10) continue;
-    current_action = byte;
+    has_staged = false;
+    set_action(byte, 0, 0, last_seq);
   }
 }
 
 void sendStatus() {
-  Wire.write(current_action == ACTION_NONE);
+  unsigned char status[STATUS_LENGTH];
+
+  status[0] = current_action == ACTION_NONE;
+  status[1] = status_angle & 0xFF;
+  status[2] = (status_angle >> 8) & 0xFF;
+  status[3] = status_flags | (frame_error ? STATUS_FRAME_ERROR : 0) | (home_failed ? STATUS_HOME_FAILED : 0) | (calibrated ? STATUS_CALIBRATED : 0);
+  status[4] = last_seq;
+  status[5] = checksum(status, STATUS_LENGTH - 1);
+
+  Wire.write(status, STATUS_LENGTH);
 }
 
 void setup()
 {
   Wire.begin(INO_ADDRESS);
+  // also listen on the general call address for CMD_GO
+  TWAR |= 1;
   Wire.onReceive(receiveCommand);
   Wire.onRequest(sendStatus);
 
@@ -305,6 +568,7 @@ void setup()
   pinMode(MAX485_DE, OUTPUT);
   pinMode(FLOOR_CONTACT_PIN, INPUT);
   pinMode(LIMIT_PIN, INPUT_PULLUP);
+  release_done_line();
 
   pinMode(HALL_A, INPUT_PULLUP);
   pinMode(HALL_B, INPUT_PULLUP);
@@ -358,37 +622,55 @@ void get_action_serial() {
       current_action = ACTION_ZERO;
     if (c == 'h')
       current_action = ACTION_HOME;
+    if (c == 'a')
+      current_action = ACTION_AUTO_HOME;
   }
 }
 
 void loop()
 {
   encoder.update();
+  if (has_calibration)
+    apply_calibration();
+  update_status();
   get_action_serial();
-  if        (current_action == ACTION_FORWARD) {
+
+  // a command received after the action finished but before it is cleared below is kept for the next loop()
+  unsigned char action = current_action;
+  if        (action == ACTION_FORWARD) {
     Serial.println("RECEIVED ACTION_FORWARD");
-    handle_forward(HIP_MOVE_INTERVAL);
-  } else if (current_action == ACTION_BACKWARD) {
+    handle_forward(current_magnitude ? current_magnitude : HIP_MOVE_INTERVAL);
+  } else if (action == ACTION_BACKWARD) {
     Serial.println("RECEIVED ACTION_BACKWARD");
-    handle_backward(HIP_MOVE_INTERVAL);
-  } else if (current_action == ACTION_UP) {
+    handle_backward(current_magnitude ? current_magnitude : HIP_MOVE_INTERVAL);
+  } else if (action == ACTION_UP) {
     Serial.println("RECEIVED ACTION_UP");
     move_up();
-  } else if (current_action == ACTION_DOWN) {
+  } else if (action == ACTION_DOWN) {
     Serial.println("RECEIVED ACTION_DOWN");
     move_down();
-  } else if (current_action == ACTION_HOME_FORWARD) {
+  } else if (action == ACTION_HOME_FORWARD) {
     Serial.println("RECEIVED ACTION_HOME_FORWARD");
     handle_forward(HIP_HOME_INTERVAL);
-  } else if (current_action == ACTION_HOME_BACKWARD) {
+  } else if (action == ACTION_HOME_BACKWARD) {
     Serial.println("RECEIVED ACTION_HOME_BACKWARD");
     handle_backward(HIP_HOME_INTERVAL);
-  } else if (current_action == ACTION_ZERO) {
+  } else if (action == ACTION_ZERO) {
     Serial.println("RECEIVED ACTION_ZERO");
     zero_encoder();
-  } else if (current_action == ACTION_HOME) {
+  } else if (action == ACTION_HOME) {
     Serial.println("RECEIVED ACTION_HOME");
     go_home();
+  } else if (action == ACTION_AUTO_HOME) {
+    Serial.println("RECEIVED ACTION_AUTO_HOME");
+    auto_home();
   }
-  current_action = ACTION_NONE;
+
+  // don't release if a command arrived since the action finished
+  noInterrupts();
+  if (current_action == action)
+    current_action = ACTION_NONE;
+  if (current_action == ACTION_NONE && (!has_staged || staged_action == ACTION_NONE))
+    release_done_line();
+  interrupts();
 }
\ No newline at end of file
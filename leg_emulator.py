@@ -0,0 +1,595 @@
+import ctypes
+import threading
+import time
+
+from i2c_comm import encodeStatus, decodeAngle, checksum, CMD_FRAME, CMD_CALIBRATE, FRAME_STAGE, FRAME_LENGTH
+
+"""
+In-process emulator of leg_controller.ino, used as a drop-in backend for I2CBus so the gait and homing code can be run and timed off the robot.
+
+LegEmulator class - stands in for smbus2.SMBus (write_byte/read_byte, and i2c_rdwr for the framed protocol), routes each transaction to the emulated leg at that address, or to every leg for the general call address. Unknown addresses raise OSError like a missing device on the real bus. Several can be given to I2CBus as separate adapters (makeEmulatedBus adapters=).
+
+LocalDoneLine class - stand-in for the shared "all done" GPIO line, driven by the emulated legs.
+
+EmulatedLeg class - one Arduino. Mirrors the firmware state machine (receiveCommand/sendStatus/loop) and takes as long per action as the firmware would, based on the constants in leg_controller.ino.
+"""
+
+# firmware constants (keep in sync with leg_controller.ino)
+STEP_UP_ITERS = 800
+HIP_MOVE_INTERVAL = 20
+HIP_HOME_INTERVAL = 5
+STEP_MAX_TIME_CONSTANT = 50
+MAX_ANGLE = 25
+HOMING_THRESHOLD = 1
+LIMIT_OFFSET = 30
+AUTO_HOME_TIMEOUT = (2 * MAX_ANGLE + LIMIT_OFFSET) * STEP_MAX_TIME_CONSTANT * 2
+
+NOT_DONE = 0
+DONE = 1
+
+ACTION_NONE = 0
+ACTION_FORWARD = 1
+ACTION_BACKWARD = 2
+ACTION_UP = 3
+ACTION_DOWN = 4
+ACTION_HOME_FORWARD = 5
+ACTION_HOME_BACKWARD = 6
+ACTION_ZERO = 7
+ACTION_HOME = 8
+ACTION_AUTO_HOME = 9
+
+GENERAL_CALL_ADDRESS = 0x00
+CMD_STAGE = 0x20
+CMD_GO = 0x40
+
+# step_up/step_down pulse the stepper with 1 ms low + 1 ms high per iteration
+STEP_UP_TIME = STEP_UP_ITERS * 0.002
+STEP_DOWN_TIME = int(STEP_UP_ITERS * 0.8) * 0.002
+
+# hip moves time out after angle * STEP_MAX_TIME_CONSTANT ms, which is also used as the hip speed (ms per degree)
+HIP_TIME_PER_DEGREE = STEP_MAX_TIME_CONSTANT / 1000
+
+# each setMotorState is two modbus register writes (8 byte request + 8 byte echo at 9600 baud), a hip move does two of them
+MODBUS_WRITE_TIME = 16 * 10 / 9600
+HIP_OVERHEAD_TIME = 4 * MODBUS_WRITE_TIME
+
+# auto homing seeks the limit switch at half speed (HOMING_SPEED), then backs off at the normal hip speed
+AUTO_HOME_TIME_PER_DEGREE = 2 * HIP_TIME_PER_DEGREE
+
+# addresses of the six legs on the robot
+DEFAULT_ADDRESSES = (0x10, 0x11, 0x12, 0x13, 0x14, 0x15)
+
+
+class EmulatedLeg:
+    def __init__(self, address, clock=time.monotonic, time_scale=1.0, action_times=None):
+
+        self.address = address
+        self.clock = clock
+        self.time_scale = time_scale
+
+        # optional fixed duration in seconds per action, replaces the firmware timing model
+        self.action_times = action_times or {}
+
+        # same direction handling as the REVERSE_DIRECTION macro
+        self.reverse_direction = address >= 0x13
+
+        # firmware state
+        self.current_action = ACTION_NONE
+        self.staged_action = ACTION_NONE
+        self.has_staged = False
+        self.encoder_angle = 0.0
+        self.zero_offset = 0.0
+        self.min_angle = -MAX_ANGLE
+        self.max_angle = MAX_ANGLE
+
+        # raw encoder angle at which the limit switch closes, the leg's home is LIMIT_OFFSET past it
+        # set limit_switch False to emulate a broken switch (auto homing then times out and flags home_failed)
+        self.limit_angle = -LIMIT_OFFSET
+        self.limit_switch = True
+        self.home_failed = False
+
+        # encoder zeroed since power on (ACTION_ZERO, auto homing or a calibration frame)
+        self.calibrated = False
+
+        # the action being run by loop(), as a list of (duration, hip degrees) segments
+        self.running = None
+        self.segments = []
+        self.started = 0.0
+        self.busy_until = 0.0
+
+        # framed protocol, hip degrees (0 for the default interval) and motor speed of the current and staged action
+        self.magnitude = 0
+        self.speed = 0
+        self.staged_magnitude = 0
+        self.staged_speed = 0
+        self.staged_seq = 0
+        self.seq = 0
+        self.frame_error = False
+
+        # knee position once the running action is done
+        self.lifted = False
+
+        # number of commands received, for checking what the Pi sent
+        self.commands = 0
+
+    def getAngle(self):
+        self.update()
+        return self.angleAt(self.clock())
+
+    def angleAt(self, now):
+        # hip angle including any move that is still in progress
+        angle = self.encoder_angle - self.zero_offset
+
+        elapsed = now - self.started
+        for duration, degrees in self.segments:
+            if elapsed <= 0:
+                break
+            if duration > 0 and elapsed < duration:
+                angle += degrees * elapsed / duration
+                break
+            angle += degrees
+            elapsed -= duration
+
+        return angle
+
+    def isBusy(self):
+        self.update()
+        return self.running is not None
+
+    def holdsDoneLine(self):
+        # firmware pulls the done line low from staging until the action finishes
+        return self.isBusy() or (self.has_staged and self.staged_action != ACTION_NONE)
+
+    def write(self, byte):
+        # receiveCommand - bytes above the action range are ignored
+        self.update()
+        self.commands += 1
+
+        if byte == CMD_GO:
+            if not self.has_staged:
+                return
+            byte = self.staged_action
+            self.has_staged = False
+            if not self.setAction(byte, self.staged_magnitude, self.staged_speed, self.staged_seq):
+                return
+
+        elif byte & 0xF0 == CMD_STAGE:
+            self.staged_action = byte & 0x0F
+            self.staged_magnitude = 0
+            self.staged_speed = 0
+            self.staged_seq = self.seq
+            self.has_staged = True
+            return
+
+        elif byte >= 0x10:
+            return
+
+        else:
+            # a direct command replaces whatever was staged, so a later GO can't start it
+            self.has_staged = False
+
+            if not self.setAction(byte, 0, 0, self.seq):
+                return
+
+        self.run(byte)
+
+    def writeFrame(self, frame):
+        # receiveCommand for a CMD_FRAME, a bad length or checksum is flagged in the status and dropped
+        self.update()
+        self.commands += 1
+
+        if len(frame) != FRAME_LENGTH or frame[0] != CMD_FRAME or checksum(frame[:-1]) != frame[-1]:
+            self.frame_error = True
+            return
+
+        self.frame_error = False
+        action, magnitude, speed, seq = frame[1] & 0x0F, frame[2], frame[3], frame[4]
+
+        if frame[1] & FRAME_STAGE:
+            self.staged_action = action
+            self.staged_magnitude = magnitude
+            self.staged_speed = speed
+            self.staged_seq = seq
+            self.has_staged = True
+            return
+
+        self.has_staged = False
+
+        if self.setAction(action, magnitude, speed, seq):
+            self.run(action)
+
+    def writeCalibration(self, frame):
+        # receiveCalibration - zero the encoder so it reads the given angle, set the hip limits
+        self.update()
+        self.commands += 1
+
+        if len(frame) != FRAME_LENGTH or checksum(frame[:-1]) != frame[-1]:
+            self.frame_error = True
+            return
+
+        self.frame_error = False
+        self.zero_offset = self.encoder_angle - decodeAngle(frame[1:3])
+        self.min_angle = int.from_bytes(frame[3:4], "little", signed=True)
+        self.max_angle = int.from_bytes(frame[4:5], "little", signed=True)
+        self.calibrated = True
+
+    def powerCycle(self):
+        # the hall encoder counts from 0 again at power on, the hip (and its limit switch) stay where they are
+        self.update()
+        self.limit_angle -= self.encoder_angle
+        self.encoder_angle = 0.0
+        self.zero_offset = 0.0
+        self.min_angle = -MAX_ANGLE
+        self.max_angle = MAX_ANGLE
+        self.calibrated = False
+        self.home_failed = False
+        self.current_action = ACTION_NONE
+        self.has_staged = False
+        self.running = None
+        self.segments = []
+
+    def setAction(self, action, magnitude, speed, seq):
+        # set_action, returns False if the command was rejected because the leg is busy (seq keeps the running frame's number, ACTION_NONE still stops a hip move)
+        if self.running is not None and action != ACTION_NONE:
+            return False
+
+        self.current_action = action
+        self.magnitude = magnitude
+        self.speed = speed
+        self.seq = seq
+        return True
+
+    def run(self, byte):
+        # loop() picks up current_action once the leg is idle
+        if self.running is None:
+            self.start(byte)
+
+        # ACTION_NONE breaks out of the hip move loops early
+        elif byte == ACTION_NONE and self.running in (ACTION_FORWARD, ACTION_BACKWARD, ACTION_HOME_FORWARD, ACTION_HOME_BACKWARD):
+            self.abort()
+
+    def read(self):
+        # sendStatus
+        self.update()
+        return DONE if self.current_action == ACTION_NONE else NOT_DONE
+
+    def statusBytes(self):
+        # sendStatus, framed protocol
+        now = self.clock()
+        done = self.read() == DONE
+        contact = self.kneeLiftAt(now) == 0.0
+
+        limit = self.limit_switch and self.angleAt(now) + self.zero_offset <= self.limit_angle + HOMING_THRESHOLD / 2
+
+        return encodeStatus(done, self.angleAt(now), contact=contact, limit=limit, frame_error=self.frame_error, home_failed=self.home_failed, calibrated=self.calibrated, seq=self.seq)
+
+    def kneeLiftAt(self, now):
+        # 0 grounded, 1 fully lifted, ramps linearly over the step_up/step_down time
+        if self.running == ACTION_UP:
+            return self.progress(now, 0)
+
+        if self.running == ACTION_DOWN:
+            return 1.0 - self.progress(now, 0)
+
+        if self.running in (ACTION_HOME, ACTION_AUTO_HOME) and len(self.segments) >= 3:
+            # up, hip moves, down
+            if now < self.started + self.segments[0][0]:
+                return self.progress(now, 0)
+            return 1.0 - self.progress(now, len(self.segments) - 1)
+
+        return 1.0 if self.lifted else 0.0
+
+    def progress(self, now, segment):
+        # fraction of a segment of the running action that has passed
+        start = self.started + sum(duration for duration, _ in self.segments[:segment])
+        duration = self.segments[segment][0]
+
+        if duration <= 0:
+            return 1.0
+
+        return min(max((now - start) / duration, 0.0), 1.0)
+
+    def update(self):
+        # finish the running action once its time is up, loop() then clears current_action
+        if self.running is not None and self.clock() >= self.busy_until:
+            self.finish()
+
+    def start(self, action):
+
+        self.started = self.clock()
+        self.segments = self.plan(action)
+
+        if action in self.action_times:
+            self.segments = self.stretch(self.segments, self.action_times[action] * self.time_scale)
+
+        if action == ACTION_ZERO:
+            self.zero_offset = self.encoder_angle
+            self.calibrated = True
+
+        self.running = action
+        self.busy_until = self.started + sum(duration for duration, _ in self.segments)
+
+    def finish(self):
+        if self.running == ACTION_UP:
+            self.lifted = True
+        elif self.running in (ACTION_DOWN, ACTION_HOME, ACTION_AUTO_HOME):
+            self.lifted = False
+
+        self.encoder_angle += sum(degrees for _, degrees in self.segments)
+
+        if self.running == ACTION_AUTO_HOME and not self.home_failed:
+            self.zero_offset = self.encoder_angle
+            self.calibrated = True
+        self.running = None
+        self.segments = []
+
+        # commands received while busy were rejected by setAction, same as the firmware
+        self.current_action = ACTION_NONE
+
+    def abort(self):
+        now = self.clock()
+        self.encoder_angle = self.angleAt(now) + self.zero_offset
+        self.segments = [(HIP_OVERHEAD_TIME / 2 * self.time_scale, 0.0)]
+        self.started = now
+        self.busy_until = now + self.segments[0][0]
+
+    def stretch(self, segments, total):
+        # keep the hip movement of each segment but make the whole action take total seconds
+        planned = sum(duration for duration, _ in segments)
+
+        if planned <= 0:
+            return [(total, sum(degrees for _, degrees in segments))]
+
+        return [(duration * total / planned, degrees) for duration, degrees in segments]
+
+    def plan(self, action):
+        # durations of each part of an action, mirrors loop() in the firmware
+        # the speed in a frame only changes the motor speed register, the timing model has no notion of it
+        if action == ACTION_FORWARD:
+            return self.handleMove(self.magnitude or HIP_MOVE_INTERVAL, forward=True)
+
+        if action == ACTION_BACKWARD:
+            return self.handleMove(self.magnitude or HIP_MOVE_INTERVAL, forward=False)
+
+        if action == ACTION_HOME_FORWARD:
+            return self.handleMove(HIP_HOME_INTERVAL, forward=True)
+
+        if action == ACTION_HOME_BACKWARD:
+            return self.handleMove(HIP_HOME_INTERVAL, forward=False)
+
+        if action == ACTION_UP:
+            return [(STEP_UP_TIME * self.time_scale, 0.0)]
+
+        if action == ACTION_DOWN:
+            return [(STEP_DOWN_TIME * self.time_scale, 0.0)]
+
+        if action == ACTION_HOME:
+            return self.goHome()
+
+        if action == ACTION_AUTO_HOME:
+            return self.autoHome()
+
+        return [(0.0, 0.0)]
+
+    def handleMove(self, angle, forward):
+        # handle_forward/handle_backward
+        if self.reverse_direction:
+            forward = not forward
+
+        return [self.moveHip(angle, forward)]
+
+    def moveHip(self, angle, forward, current=None):
+        # move_forward/move_backward, stops at the angle limits or after the step timeout
+        if current is None:
+            current = self.encoder_angle - self.zero_offset
+
+        if forward:
+            if current >= self.max_angle:
+                return (0.0, 0.0)
+            end = min(current + angle, self.max_angle)
+        else:
+            if current <= self.min_angle:
+                return (0.0, 0.0)
+            end = max(current - angle, self.min_angle)
+
+        degrees = end - current
+        duration = min(abs(degrees), angle) * HIP_TIME_PER_DEGREE + HIP_OVERHEAD_TIME
+
+        return (duration * self.time_scale, degrees)
+
+    def goHome(self):
+        angle = self.encoder_angle - self.zero_offset
+        if abs(angle) < HOMING_THRESHOLD:
+            return [(0.0, 0.0)]
+
+        up = (STEP_UP_TIME * self.time_scale, 0.0)
+        down = (STEP_DOWN_TIME * self.time_scale, 0.0)
+
+        if angle < 0:
+            hip = self.moveHip(-angle, True, angle)
+        else:
+            hip = self.moveHip(angle, False, angle)
+
+        return [up, hip, down]
+
+
+    def autoHome(self):
+        # auto_home - up, seek the limit switch, back off LIMIT_OFFSET and zero, down
+        up = (STEP_UP_TIME * self.time_scale, 0.0)
+        down = (STEP_DOWN_TIME * self.time_scale, 0.0)
+
+        if not self.limit_switch:
+            self.home_failed = True
+            return [up, (AUTO_HOME_TIMEOUT / 1000 * self.time_scale, 0.0), down]
+
+        self.home_failed = False
+
+        seek = self.limit_angle - self.encoder_angle
+        back_off = (LIMIT_OFFSET * HIP_TIME_PER_DEGREE + HIP_OVERHEAD_TIME / 2) * self.time_scale
+
+        return [up, ((abs(seek) * AUTO_HOME_TIME_PER_DEGREE + HIP_OVERHEAD_TIME / 2) * self.time_scale, seek), (back_off, float(LIMIT_OFFSET)), down]
+
+
+class LegEmulator:
+    def __init__(self, addresses=DEFAULT_ADDRESSES, time_scale=1.0, op_latency=0.0, clock=time.monotonic, action_times=None):
+        """
+        time_scale - multiplies every action duration (0.01 runs gaits 100x faster than the robot)
+        op_latency - seconds added to every bus transaction, to model the I2C clock
+        action_times - optional {action: seconds} to use instead of the firmware timing model
+        """
+
+        self.clock = clock
+        self.time_scale = time_scale
+        self.op_latency = op_latency
+        self.legs = {address: EmulatedLeg(address, clock, time_scale, action_times) for address in addresses}
+
+        # transaction counters
+        self.writes = 0
+        self.reads = 0
+
+        # addresses that stop answering, for testing how the Pi copes with a dead leg
+        self.unplugged = set()
+
+        # one transaction at a time, like a real adapter (telemetry polls from its own thread)
+        self.lock = threading.Lock()
+
+    def unplug(self, address):
+        self.unplugged.add(address)
+
+    def plug(self, address):
+        self.unplugged.discard(address)
+
+    def getLeg(self, address):
+        leg = self.legs.get(address)
+
+        if leg is None or address in self.unplugged:
+            # same errno smbus2 raises when nothing acks the address
+            raise OSError(121, "Remote I/O error")
+
+        return leg
+
+    def transaction(self):
+        if self.op_latency > 0:
+            time.sleep(self.op_latency)
+
+    def write_byte(self, address, value):
+        with self.lock:
+            self.transaction()
+            self.writes += 1
+
+            # general call reaches every leg
+            if address == GENERAL_CALL_ADDRESS:
+                for leg in self.legs.values():
+                    leg.write(value & 0xFF)
+                return
+
+            self.getLeg(address).write(value & 0xFF)
+
+    def read_byte(self, address):
+        with self.lock:
+            self.transaction()
+            self.reads += 1
+            return self.getLeg(address).read()
+
+    def i2c_rdwr(self, *messages):
+        with self.lock:
+            TransferMessages(self, messages, self.transaction)
+
+    def busyUntil(self):
+        # time at which the last running action finishes
+        return max((leg.busy_until for leg in self.legs.values() if leg.isBusy()), default=self.clock())
+
+    def close(self):
+        pass
+
+
+def TransferMessages(emulator, messages, transaction=None):
+    """
+    smbus2 i2c_rdwr on emulated legs, each i2c_msg is a write (frame, or plain command bytes) or a status read. Like the kernel, a leg that doesn't ack stops the transfer with OSError after the messages before it have gone out
+    """
+
+    for message in messages:
+        if transaction is not None:
+            transaction()
+
+        # I2C_M_RD
+        if message.flags & 1:
+            emulator.reads += 1
+            status = emulator.getLeg(message.addr).statusBytes()[:message.len]
+            ctypes.memmove(message.buf, status, len(status))
+            continue
+
+        emulator.writes += 1
+        data = bytes(message)
+
+        if message.addr == GENERAL_CALL_ADDRESS:
+            legs = list(emulator.legs.values())
+        else:
+            legs = [emulator.getLeg(message.addr)]
+
+        for leg in legs:
+            if data[:1] == bytes([CMD_FRAME]):
+                leg.writeFrame(data)
+            elif data[:1] == bytes([CMD_CALIBRATE]):
+                leg.writeCalibration(data)
+            else:
+                for byte in data:
+                    leg.write(byte)
+
+
+class LocalDoneLine:
+    def __init__(self, emulator):
+        """
+        Stand-in for GPIODoneLine driven by a LegEmulator, the line is high once no leg has an action staged or running.
+        """
+
+        self.emulator = emulator
+
+    def isDone(self):
+        return not any(leg.holdsDoneLine() for leg in self.emulator.legs.values())
+
+    def waitForDone(self, timeout=None):
+        clock = self.emulator.clock
+        deadline = None if timeout is None else clock() + timeout
+
+        while not self.isDone():
+            now = clock()
+
+            if deadline is not None and now >= deadline:
+                return False
+
+            # legs that are only staged never release the line on their own
+            wait = self.emulator.busyUntil() - now
+            if wait <= 0:
+                wait = 0.001
+            if deadline is not None:
+                wait = min(wait, deadline - now)
+
+            time.sleep(wait)
+
+        return True
+
+
+def makeEmulatedBus(addresses=DEFAULT_ADDRESSES, time_scale=1.0, op_latency=0.0, done_line=False, action_times=None, adapters=1, framed=False):
+    """
+    Returns an I2CBus with a GMTIno for each address, backed by a LegEmulator (and a LocalDoneLine if done_line is set).
+    adapters - split the legs evenly over this many emulated adapters, each its own LegEmulator
+    framed - use the framed protocol
+    """
+
+    from i2c_comm import I2CBus, GMTIno
+
+    # consecutive legs share an adapter
+    per_adapter = -(-len(addresses) // adapters)
+    groups = [addresses[i:i + per_adapter] for i in range(0, len(addresses), per_adapter)]
+    emulators = [LegEmulator(group, time_scale=time_scale, op_latency=op_latency, action_times=action_times) for group in groups]
+
+    extra = {f"emulated-{i}": emulator for i, emulator in enumerate(emulators[1:], 1)}
+    leg_adapters = {address: f"emulated-{i}" for i, group in enumerate(groups[1:], 1) for address in group}
+
+    emulator = emulators[0]
+    bus = I2CBus(emulator, done_line=LocalDoneLine(emulator) if done_line and adapters == 1 else None, adapters=extra, leg_adapters=leg_adapters, framed=framed)
+
+    bus.addDevices(*[GMTIno(f"leg{i + 1}", address) for i, address in enumerate(addresses)])
+
+    return bus
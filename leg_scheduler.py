@@ -0,0 +1,191 @@
+import time
+
+from gaits import ACTION_NONE, ACTION_FORWARD, ACTION_BACKWARD, ACTION_UP, ACTION_DOWN
+from i2c_comm import I2CBus, POLL_INTERVAL
+from metrics import METRICS
+
+"""
+Per-leg scheduling of a gait. Instead of a barrier after every step of a gait table (send to all six, wait for all six), each leg gets its own stream of actions and only waits on the actions it depends on.
+
+Dependencies are derived from the table:
+- every leg runs its own actions in table order
+- a leg may not lift (ACTION_UP) until every other leg has finished its last earlier lift or lower, e.g. group 2 may not lift until group 1 is down
+- a hip move on a grounded leg (stance push) waits for the same, so it pushes with the support pattern the table intended
+- hip moves in the air and ACTION_DOWN only wait on the leg's own previous action
+- anything else (homing, zeroing) waits for the last earlier action of every other leg
+
+Extra constraints can be given as (leg, step, after_leg, after_step) tuples, leg/step index into the gait table.
+"""
+
+KNEE_ACTIONS = (ACTION_UP, ACTION_DOWN)
+HIP_ACTIONS = (ACTION_FORWARD, ACTION_BACKWARD)
+
+
+class LegTask:
+    __slots__ = ("leg", "step", "action", "after")
+
+    def __init__(self, leg, step, action):
+
+        self.leg = leg
+        self.step = step
+        self.action = action
+
+        # (leg, step) keys of the tasks that must finish before this one starts
+        self.after = set()
+
+
+class LegSchedule:
+    def __init__(self, streams, addresses):
+
+        # streams[i] is the list of LegTasks for the leg at addresses[i]
+        self.streams = streams
+        self.addresses = addresses
+
+
+def BuildSchedule(gait_type, addresses, constraints=()):
+    """
+    Split a gait (GaitPlan or list of step tuples) into per-leg action streams with their dependencies
+    """
+
+    num_legs = len(addresses)
+    streams = [[] for _ in range(num_legs)]
+    tasks = {}
+
+    # last lift/lower and last action of each leg so far, and whether it is in the air
+    last_knee = [None] * num_legs
+    last_action = [None] * num_legs
+    in_air = [False] * num_legs
+
+    for step, inst in enumerate(gait_type):
+        for leg in range(num_legs):
+            action = inst[leg]
+
+            if action == ACTION_NONE:
+                continue
+
+            task = LegTask(leg, step, action)
+            others = [other for other in range(num_legs) if other != leg]
+
+            if last_action[leg] is not None:
+                task.after.add(last_action[leg])
+
+            if action == ACTION_UP or (action in HIP_ACTIONS and not in_air[leg]):
+                task.after.update(last_knee[other] for other in others if last_knee[other] is not None)
+
+            elif action not in HIP_ACTIONS and action != ACTION_DOWN:
+                task.after.update(last_action[other] for other in others if last_action[other] is not None)
+
+            streams[leg].append(task)
+            tasks[(leg, step)] = task
+
+        # only update after the whole step so legs in the same step don't wait on each other
+        for leg in range(num_legs):
+            action = inst[leg]
+
+            if action == ACTION_NONE:
+                continue
+
+            last_action[leg] = (leg, step)
+
+            if action in KNEE_ACTIONS:
+                last_knee[leg] = (leg, step)
+                in_air[leg] = action == ACTION_UP
+
+    for leg, step, after_leg, after_step in constraints:
+        if (leg, step) not in tasks or (after_leg, after_step) not in tasks:
+            raise ValueError(f"Constraint on leg {leg} step {step} after leg {after_leg} step {after_step} refers to an empty action")
+
+        tasks[(leg, step)].after.add((after_leg, after_step))
+
+    return LegSchedule(streams, tuple(addresses))
+
+
+class ScheduleRun:
+    def __init__(self, schedule: LegSchedule):
+        """
+        Progress of one run through a schedule, shared by the blocking and asyncio drivers
+        """
+
+        self.schedule = schedule
+        self.next = [0] * len(schedule.streams)
+        self.running = {}
+        self.completed = set()
+
+        # when each running leg was started, for per leg action latency
+        self.started = {}
+
+    def isDone(self):
+        return not self.running and all(i == len(stream) for i, stream in zip(self.next, self.schedule.streams))
+
+    def takeReady(self):
+        # (addresses, actions) of every leg that is idle and whose next action has its dependencies met
+        addresses = []
+        actions = []
+
+        for leg, stream in enumerate(self.schedule.streams):
+            if leg in self.running or self.next[leg] == len(stream):
+                continue
+
+            task = stream[self.next[leg]]
+            if not task.after <= self.completed:
+                continue
+
+            self.running[leg] = task
+            self.started[leg] = time.perf_counter()
+            self.next[leg] += 1
+            addresses.append(self.schedule.addresses[leg])
+            actions.append(task.action)
+
+        return addresses, actions
+
+    def runningAddresses(self):
+        return [self.schedule.addresses[leg] for leg in self.running]
+
+    def markFinished(self, addresses):
+        for leg, address in enumerate(self.schedule.addresses):
+            if address in addresses and leg in self.running:
+                task = self.running.pop(leg)
+                self.completed.add((task.leg, task.step))
+                METRICS.observe("leg_action", time.perf_counter() - self.started.pop(leg), addr=hex(address), action=task.action)
+
+
+def PollRunning(bus: I2CBus, run: ScheduleRun):
+    """Poll the legs that are running an action, returns the addresses that finished"""
+
+    devices = [bus.devices_by_address[address] for address in run.runningAddresses()]
+    pending = bus.pollPending(devices)
+
+    return set(device.address for device in devices) - set(device.address for device in pending)
+
+
+def RunSchedule(bus: I2CBus, schedule: LegSchedule):
+    """Run a schedule on the bus, starting each leg's next action as soon as its dependencies finish"""
+
+    run = ScheduleRun(schedule)
+
+    while not run.isDone():
+        addresses, actions = run.takeReady()
+
+        if addresses:
+            bus.dispatch(addresses, actions)
+
+        finished = PollRunning(bus, run)
+        run.markFinished(finished)
+
+        if not finished:
+            time.sleep(POLL_INTERVAL)
+
+
+# schedules built so far, keyed by gait id and addresses
+SCHEDULES = {}
+
+
+def ScheduleFor(plan):
+    """Schedule for a compiled GaitPlan, built once and reused"""
+
+    key = (plan.gait_id, plan.addresses)
+
+    if key not in SCHEDULES:
+        SCHEDULES[key] = BuildSchedule(plan, plan.addresses)
+
+    return SCHEDULES[key]
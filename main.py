@@ -1,65 +1,212 @@
-from gait_and_homing import JoystickToGait, HomeMotors
-from i2c_comm import I2CBus, GMTIno
-from joystick import GMTJoystick
+import os
+import signal
+import socket
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 """
 Main loop for hexapod control. Continuously monitor the joystick for input and use higher level functions to convert the joystick input to gait commands
+
+Startup runs the bus setup (open, probe every leg at once, compile gaits, restore calibration) on a worker thread while the main thread waits for the controller, and only imports what the chosen backend needs. Once both are done the time spent in each phase is printed and systemd is told the service is ready (Type=notify in start_hexapod.service).
 """
 
-# init bus and controller
-print("Initializing I2C Bus and controller")
-bus = I2CBus()
-j = GMTJoystick()
-
-# initialize legs
-leg1 = GMTIno("leg1", 0x10)
-leg2 = GMTIno("leg2", 0x11)
-leg3 = GMTIno("leg3", 0x12)
-
-leg4 = GMTIno("leg4", 0x13)
-leg5 = GMTIno("leg5", 0x14)
-leg6 = GMTIno("leg6", 0x15)
-
-# add legs to bus
-bus.addDevices(leg1, leg2, leg3, leg4, leg5, leg6)
-print("Bus Devices and Addresses:")
-print([d for d in bus.devices.keys()])
-print([hex(d.address) for d in bus.devices.values()])
-print(leg1.bus)
-
-# main loop for converting joystick to arduino-side commands
-def joystickLoop():
-    
-    while True:
-        
-        # get raw controller input
-        controls = j.getControls()
-        print(controls)
-
-        if controls is not None:
-            
-            # get controls (y btn for coolness factor)
-            x, y, a_btn, y_btn, b_btn, x_btn, left_joy = controls
-            print(f"x: {x}, y: {y}, A: {a_btn}, Y: {y_btn}, B: {b_btn}, X: {x_btn}, Left Joy: {left_joy}")
-            print()
-            
-            if y_btn:
-                print("Starting Manual Homing")
-                HomeMotors(bus, j)
-                print("Finished Manual Homing")
-            
-            # convert x and y signal to move single leg
-            # TestOneLeg(x, y, bus)
-            
-            # test i2c comm
-            # testI2C(bus)
-            
-            # # converts user input to gait
-            JoystickToGait(x, y, a_btn, x_btn, left_joy, bus)
-
-        time.sleep(2)
-    
-# constantly run joystick loop    
-joystickLoop()
+# legs on the robot
+LEGS = (
+    ("leg1", 0x10),
+    ("leg2", 0x11),
+    ("leg3", 0x12),
+    ("leg4", 0x13),
+    ("leg5", 0x14),
+    ("leg6", 0x15),
+)
+
+
+class StartupTimer:
+    def __init__(self):
+
+        self.start = time.perf_counter()
+
+        # (phase, seconds) in the order they finished
+        self.phases = []
+
+    def phase(self, name, started):
+        # record a phase that began at started (perf_counter)
+        self.phases.append((name, time.perf_counter() - started))
+
+    def report(self):
+        from metrics import METRICS
+
+        total = time.perf_counter() - self.start
+
+        print("Startup times:")
+        for name, seconds in self.phases:
+            print(f"  {name:<12} {seconds:7.3f}s")
+            METRICS.observe("startup", seconds, phase=name)
+        print(f"  {'ready':<12} {total:7.3f}s")
+
+        METRICS.observe("startup", total, phase="ready")
+
+
+def NotifySystemd(state):
+    """Send a state (e.g. READY=1) to systemd's notify socket, does nothing when not run by systemd"""
+
+    path = os.environ.get("NOTIFY_SOCKET")
+    if not path:
+        return
+
+    # leading @ is an abstract socket
+    if path.startswith("@"):
+        path = "\0" + path[1:]
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(path)
+            sock.sendall(state.encode())
+
+    except OSError as e:
+        print(f"sd_notify failed: {e}")
+
+
+def OpenBus(framed):
+    """I2CBus for the backend picked by the environment, only imports that backend"""
+
+    from i2c_comm import I2CBus
+
+    # GMT_EMULATE=1 runs against emulated legs instead of the real bus, GMT_EMULATE=sim against the MuJoCo model
+    if os.environ.get("GMT_EMULATE") == "sim":
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "gait_simulation"))
+        from sim_bus import SimLegs
+        return I2CBus(SimLegs(), framed=framed)
+
+    if os.environ.get("GMT_EMULATE"):
+        from leg_emulator import LegEmulator
+        return I2CBus(LegEmulator(), framed=framed)
+
+    if os.environ.get("GMT_I2C_ADAPTERS"):
+        # legs moved to extra adapters, e.g. GMT_I2C_ADAPTERS="3=0x13,0x14,0x15", the rest stay on i2c-1
+        from i2c_comm import openAdapters
+        adapters, leg_adapters = openAdapters(os.environ["GMT_I2C_ADAPTERS"])
+        return I2CBus(adapters=adapters, leg_adapters=leg_adapters, framed=framed)
+
+    return I2CBus(framed=framed)
+
+
+def SetupBus(timer):
+    """Open the bus, probe the legs, compile the gaits and restore calibration, returns (bus, calibration)"""
+
+    from i2c_comm import GMTIno
+    from gait_and_homing import CompileGaits
+
+    # GMT_FRAMED=1 talks to legs running the framed protocol firmware
+    framed = os.environ.get("GMT_FRAMED") == "1"
+
+    started = time.perf_counter()
+    bus = OpenBus(framed)
+    bus.addDevices(*[GMTIno(name, address) for name, address in LEGS])
+    timer.phase("bus", started)
+
+    # every leg at once, a missing leg is reported here instead of on the first gait
+    started = time.perf_counter()
+    answered = bus.probe()
+    timer.phase("probe", started)
+
+    print("Bus Devices and Addresses:")
+    print([name for name, _ in LEGS])
+    print([hex(address) for _, address in LEGS])
+
+    missing = [name for name, address in LEGS if address not in answered]
+    if missing:
+        print("Legs not answering", missing)
+
+    # check every gait table once and compile it for these legs
+    started = time.perf_counter()
+    CompileGaits(bus)
+    timer.phase("gaits", started)
+
+    # with the framed protocol the legs pick up their stored calibration (calibration.json, or GMT_CALIBRATION) instead of homing after every restart
+    calibration = None
+    if framed:
+        from calibration import CalibrationStore, RestoreCalibration
+
+        started = time.perf_counter()
+        calibration = CalibrationStore()
+        needs_homing = RestoreCalibration(bus, calibration)
+        timer.phase("calibration", started)
+
+        if needs_homing:
+            print("Press Y to home", needs_homing)
+
+    # GMT_RECORD=<dir> records every action dispatched to the legs (play back with recorder.py)
+    if os.environ.get("GMT_RECORD"):
+        import atexit
+        from recorder import BusRecorder
+        bus.recorder = BusRecorder(bus.leg_addresses, os.environ["GMT_RECORD"])
+        atexit.register(bus.recorder.close)
+
+    # GMT_TELEMETRY=1 (with GMT_FRAMED=1) streams every leg's status into ring buffers in the background, see telemetry.py
+    if os.environ.get("GMT_TELEMETRY") == "1":
+        from telemetry import Telemetry
+        Telemetry(bus).start()
+
+    return bus, calibration
+
+
+def WaitForController(timer, stop=None):
+    """GMTJoystick once a controller connects, None if stop (threading.Event) is set first"""
+
+    from joystick import GMTJoystick, NoControllerError
+
+    started = time.perf_counter()
+
+    try:
+        joystick = GMTJoystick(stop=stop)
+    except NoControllerError:
+        return None
+
+    timer.phase("controller", started)
+
+    return joystick
+
+
+def main():
+    timer = StartupTimer()
+
+    # systemd stops the service with SIGTERM, exit normally so the hip angles are saved on the way out
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # init bus and controller
+    print("Initializing I2C Bus and controller")
+    NotifySystemd("STATUS=Initializing I2C bus and waiting for controller")
+
+    # pygame stays on the main thread, the bus is set up alongside it
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="startup") as pool:
+        bus_setup = pool.submit(SetupBus, timer)
+
+        # a failed setup (e.g. no I2C adapter) stops the wait for the controller, so the error shows straight away instead of once one connects
+        setup_failed = threading.Event()
+        bus_setup.add_done_callback(lambda setup: setup.exception() is None or setup_failed.set())
+
+        j = WaitForController(timer, setup_failed)
+        bus, calibration = bus_setup.result()
+
+    from control_loop import RunControlLoop
+    from metrics import startFromEnv
+
+    # latency metrics endpoint (GMT_METRICS_PORT) and/or periodic JSON dump (GMT_METRICS_JSON)
+    metrics_exporters = startFromEnv()
+
+    timer.report()
+    NotifySystemd("READY=1\nSTATUS=Running")
+
+    # constantly run input, gait and bus tasks
+    try:
+        RunControlLoop(bus, j, calibration)
+    finally:
+        for exporter in metrics_exporters:
+            exporter.close()
+
 
+if __name__ == "__main__":
+    main()
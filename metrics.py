@@ -0,0 +1,261 @@
+import json
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+Latency histograms and error counters for the control stack.
+
+Histogram class - fixed log-spaced buckets from 50 us to about a minute, p50/p95/p99 are read from the bucket counts so recording is O(1) with no per-sample storage.
+
+Metrics class - registry of histograms keyed by operation and labels (leg, gait) and counters (I2C OSErrors per address). METRICS is the shared instance used by i2c_comm.py and gait_and_homing.py.
+
+MetricsServer class - local HTTP endpoint, /metrics returns Prometheus text and /metrics.json the same numbers as JSON.
+
+JsonDumper class - writes the JSON snapshot to a file every few seconds, for when nothing is scraping the endpoint.
+"""
+
+# smallest bucket bound in seconds and growth factor between buckets
+BUCKET_START = 50e-6
+BUCKET_FACTOR = 1.25
+NUM_BUCKETS = 64
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    def __init__(self):
+
+        self.counts = [0] * (NUM_BUCKETS + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    @staticmethod
+    def bucketBound(i):
+        # upper bound of bucket i
+        return BUCKET_START * BUCKET_FACTOR ** i
+
+    def observe(self, seconds):
+        if seconds <= BUCKET_START:
+            i = 0
+        else:
+            i = min(math.ceil(math.log(seconds / BUCKET_START, BUCKET_FACTOR)), NUM_BUCKETS)
+
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-th sample, capped at the largest sample seen
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.bucketBound(i), self.max)
+
+        return self.max
+
+    def snapshot(self):
+        summary = {f"p{int(q * 100)}": self.quantile(q) for q in QUANTILES}
+        summary.update(count=self.count, sum=self.sum, max=self.max)
+
+        return summary
+
+
+class Timer:
+    __slots__ = ("metrics", "op", "labels", "start")
+
+    def __init__(self, metrics, op, labels):
+        self.metrics = metrics
+        self.op = op
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.op, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Metrics:
+    def __init__(self):
+
+        # (op, sorted label items) -> Histogram
+        self.histograms = {}
+
+        # (name, sorted label items) -> count
+        self.counters = {}
+
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def observe(self, op, seconds, **labels):
+        key = (op, tuple(sorted(labels.items())))
+
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+
+            histogram.observe(seconds)
+
+    def time(self, op, **labels):
+        """Context manager that records how long the block took"""
+        return Timer(self, op, labels)
+
+    def count(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            histograms = [(op, dict(labels), h.snapshot()) for (op, labels), h in self.histograms.items()]
+            counters = [(name, dict(labels), n) for (name, labels), n in self.counters.items()]
+
+        return {
+            "uptime": time.time() - self.started,
+            "latency": [dict(op=op, labels=labels, **summary) for op, labels, summary in histograms],
+            "counters": [dict(name=name, labels=labels, value=n) for name, labels, n in counters],
+        }
+
+    def toJSON(self):
+        return json.dumps(self.snapshot(), separators=(",", ":"))
+
+    def toPrometheus(self):
+        snapshot = self.snapshot()
+        lines = [
+            "# TYPE gmt_latency_seconds summary",
+        ]
+
+        for entry in snapshot["latency"]:
+            labels = dict(op=entry["op"], **entry["labels"])
+
+            for q in QUANTILES:
+                lines.append(f"gmt_latency_seconds{formatLabels(labels, quantile=q)} {entry[f'p{int(q * 100)}']:.6f}")
+
+            lines.append(f"gmt_latency_seconds_sum{formatLabels(labels)} {entry['sum']:.6f}")
+            lines.append(f"gmt_latency_seconds_count{formatLabels(labels)} {entry['count']}")
+
+        names = sorted(set(entry["name"] for entry in snapshot["counters"]))
+        for name in names:
+            lines.append(f"# TYPE gmt_{name} counter")
+
+            for entry in snapshot["counters"]:
+                if entry["name"] == name:
+                    lines.append(f"gmt_{name}{formatLabels(entry['labels'])} {entry['value']}")
+
+        lines.append(f"gmt_uptime_seconds {snapshot['uptime']:.1f}")
+
+        return "\n".join(lines) + "\n"
+
+
+def formatLabels(labels, **extra):
+    labels = dict(labels, **extra)
+
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+class MetricsServer:
+    def __init__(self, metrics, port=9100, host="127.0.0.1"):
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = metrics.toPrometheus().encode()
+                    content_type = "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body = metrics.toJSON().encode()
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                # don't print every scrape
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class JsonDumper:
+    def __init__(self, metrics, path, interval=10.0):
+
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="metrics-dump", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def dump(self):
+        # write then rename so readers never see a half written file
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(self.metrics.toJSON())
+        os.replace(tmp, self.path)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.dump()
+
+    def close(self):
+        self.stopped.set()
+        self.dump()
+
+
+def startFromEnv(metrics=None):
+    """
+    Start the endpoint and/or dumper from GMT_METRICS_PORT and GMT_METRICS_JSON, returns what was started
+    """
+
+    metrics = metrics if metrics is not None else METRICS
+    started = []
+
+    port = os.environ.get("GMT_METRICS_PORT")
+    if port:
+        started.append(MetricsServer(metrics, int(port)).start())
+
+    path = os.environ.get("GMT_METRICS_JSON")
+    if path:
+        started.append(JsonDumper(metrics, path).start())
+
+    return started
+
+
+# shared metrics for the control stack
+METRICS = Metrics()
@@ -0,0 +1,261 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+"""
+Compact binary recording and playback of what the simulator or the robot did.
+
+A recording is a directory of fixed size .npy chunks, each a memory-mapped structured array (np.lib.format.open_memmap), plus meta.json with the dtype, chunk size, row count and anything the writer wants to keep (addresses, actuator names). Rows go straight into the mapped chunk, so recording a long session only keeps one chunk in memory and playing it back maps one chunk at a time.
+
+Recorder class - appends rows to a recording
+SimRecorder class - per step actuator targets (data.ctrl) and joint states (data.qpos, data.qvel) from the simulator
+BusRecorder class - action bytes dispatched to each leg, set as I2CBus.recorder to record every dispatch
+Recording class - reads a recording back chunk by chunk
+
+PlayIntoSim and PlayThroughBus replay a sim or bus recording.
+"""
+
+# rows per chunk file
+CHUNK_ROWS = 4096
+
+META_FILE = "meta.json"
+
+
+def chunkPath(path, index):
+    return os.path.join(path, f"chunk_{index:05d}.npy")
+
+
+class Recorder:
+    def __init__(self, path, dtype, kind, chunk_rows=CHUNK_ROWS, **meta):
+        """
+        path - directory for the recording, created if needed
+        dtype - numpy structured dtype of one row
+        kind - what was recorded ("sim" or "bus"), checked by the players
+        meta - extra JSON serializable info stored with the recording
+        """
+
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.kind = kind
+        self.chunk_rows = chunk_rows
+        self.meta = meta
+
+        self.rows = 0
+        self.chunk = None
+        self.chunk_index = -1
+
+    def nextChunk(self):
+        if self.chunk is not None:
+            self.chunk.flush()
+
+            # keep meta.json current so a crash only loses the rows of the open chunk
+            self.writeMeta()
+
+        self.chunk_index += 1
+        self.chunk = np.lib.format.open_memmap(chunkPath(self.path, self.chunk_index), mode="w+", dtype=self.dtype, shape=(self.chunk_rows,))
+
+    def newRow(self):
+        """Returns the next row to fill in, a view into the mapped chunk"""
+
+        i = self.rows % self.chunk_rows
+        if i == 0:
+            self.nextChunk()
+
+        self.rows += 1
+        return self.chunk[i]
+
+    def close(self):
+        if self.chunk is not None:
+            self.chunk.flush()
+            self.chunk = None
+
+        self.writeMeta()
+
+    def writeMeta(self):
+        meta = {
+            "kind": self.kind,
+            "dtype": self.dtype.descr,
+            "chunk_rows": self.chunk_rows,
+            "rows": self.rows,
+        }
+        meta.update(self.meta)
+
+        with open(os.path.join(self.path, META_FILE), "w") as f:
+            json.dump(meta, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class SimRecorder(Recorder):
+    def __init__(self, model, path, chunk_rows=CHUNK_ROWS):
+
+        dtype = [
+            ("t", "f8"),
+            # same precision as MuJoCo, so replaying ctrl reproduces the run exactly
+            ("ctrl", "f8", (model.nu,)),
+            ("qpos", "f8", (model.nq,)),
+            ("qvel", "f8", (model.nv,)),
+        ]
+        super().__init__(path, dtype, "sim", chunk_rows, timestep=model.opt.timestep)
+
+    def record(self, data):
+        # call right before mj_step, so replaying ctrl row by row gives the same trajectory
+        row = self.newRow()
+        row["t"] = data.time
+        row["ctrl"] = data.ctrl
+        row["qpos"] = data.qpos
+        row["qvel"] = data.qvel
+
+
+class BusRecorder(Recorder):
+    def __init__(self, addresses, path, chunk_rows=CHUNK_ROWS):
+        """
+        addresses - leg addresses, one column each in the recording
+        """
+
+        self.columns = {address: i for i, address in enumerate(addresses)}
+        self.start = time.perf_counter()
+
+        dtype = [
+            ("t", "f8"),
+            ("actions", "u1", (len(addresses),)),
+            ("sent", "?", (len(addresses),)),
+        ]
+        super().__init__(path, dtype, "bus", chunk_rows, addresses=list(addresses))
+
+    def recordDispatch(self, addresses, actions):
+        # one row per dispatch, legs that weren't sent anything have sent False
+        row = self.newRow()
+        row["t"] = time.perf_counter() - self.start
+        row["actions"] = 0
+        row["sent"] = False
+
+        for address, action in zip(addresses, actions):
+            i = self.columns[address]
+            row["actions"][i] = action
+            row["sent"][i] = True
+
+
+class Recording:
+    def __init__(self, path):
+
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+
+        self.path = path
+        self.kind = self.meta["kind"]
+        self.rows = self.meta["rows"]
+        self.chunk_rows = self.meta["chunk_rows"]
+
+    def __len__(self):
+        return self.rows
+
+    def chunks(self):
+        """Yields each chunk as a read-only memory map, trimmed to the rows that were written"""
+
+        for index in range((self.rows + self.chunk_rows - 1) // self.chunk_rows):
+            chunk = np.load(chunkPath(self.path, index), mmap_mode="r")
+            yield chunk[:min(self.chunk_rows, self.rows - index * self.chunk_rows)]
+
+    def __iter__(self):
+        for chunk in self.chunks():
+            yield from chunk
+
+
+def PlayIntoSim(recording, model, data, step=None):
+    """
+    Replay a sim recording's actuator targets into data.ctrl, one physics step per row.
+    The trajectory matches the recorded one when data starts in the state the recording did (e.g. a fresh MjData of the same model).
+    step(model, data) defaults to mujoco.mj_step, pass a wrapper to sync a viewer or pace playback.
+    """
+
+    if recording.kind != "sim":
+        raise ValueError(f"Can't play a {recording.kind} recording into the simulator")
+
+    if step is None:
+        import mujoco
+        step = mujoco.mj_step
+
+    for chunk in recording.chunks():
+        for ctrl in chunk["ctrl"]:
+            data.ctrl[:] = ctrl
+            step(model, data)
+
+
+def PlayThroughBus(recording, bus, realtime=True, wait=True):
+    """
+    Replay a bus recording through an I2CBus (real, emulated or simulated legs).
+    realtime - keep the recorded gaps between dispatches
+    wait - wait for the legs sent an action to finish before the next dispatch
+    """
+
+    if recording.kind != "bus":
+        raise ValueError(f"Can't play a {recording.kind} recording through the bus")
+
+    from i2c_comm import POLL_INTERVAL
+
+    addresses = recording.meta["addresses"]
+    start = time.perf_counter()
+
+    for chunk in recording.chunks():
+        for t, actions, sent in zip(chunk["t"], chunk["actions"], chunk["sent"]):
+            if realtime:
+                time.sleep(max(0.0, t - (time.perf_counter() - start)))
+
+            targets = [address for address, was_sent in zip(addresses, sent) if was_sent]
+            bus.dispatch(targets, [int(action) for action, was_sent in zip(actions, sent) if was_sent])
+
+            if not wait:
+                continue
+
+            pending = [bus.devices_by_address[address] for address in targets]
+            while pending:
+                pending = bus.pollPending(pending)
+                if pending:
+                    time.sleep(POLL_INTERVAL)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show or replay a recording")
+    parser.add_argument("path")
+    parser.add_argument("--play", action="store_true", help="replay a bus recording through the legs (GMT_EMULATE=1 for emulated legs)")
+    parser.add_argument("--fast", action="store_true", help="don't keep the recorded gaps between dispatches")
+    args = parser.parse_args(argv)
+
+    recording = Recording(args.path)
+    print(f"{recording.kind} recording, {len(recording)} rows in {args.path}")
+
+    if not args.play:
+        return 0
+
+    if recording.kind != "bus":
+        print("Sim recordings are played with gait_simulation/play_recording.py")
+        return 1
+
+    from i2c_comm import I2CBus, GMTIno
+
+    if os.environ.get("GMT_EMULATE"):
+        from leg_emulator import LegEmulator
+        bus = I2CBus(LegEmulator())
+    else:
+        bus = I2CBus()
+
+    bus.addDevices(*[GMTIno(f"leg{i + 1}", address) for i, address in enumerate(recording.meta["addresses"])])
+    PlayThroughBus(recording, bus, realtime=not args.fast)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,4 +2,6 @@
 
 source ~/.bashrc
 source ~/mech/bin/activate
-python -u /home/pi/new/GiantMurderTarantula/main.py
+
+# exec so python is the service's main process and can send sd_notify READY=1 (Type=notify)
+exec python -u /home/pi/new/GiantMurderTarantula/main.py
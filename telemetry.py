@@ -0,0 +1,161 @@
+import threading
+import time
+
+import numpy as np
+
+from event_log import LOG
+from metrics import METRICS
+
+"""
+Leg telemetry stream for the framed protocol (I2CBus framed=True).
+
+Telemetry class - background thread that reads the status of every leg at a fixed rate (one batched transfer per adapter, see I2CBus.readStatuses) and appends it to a preallocated ring buffer per leg. Homing, the gait code and the GUI read hip angle, ground contact and the limit switch from here instead of issuing their own I2C transactions.
+
+Each ring buffer is a structured numpy array (TELEMETRY_DTYPE) of size rows, row i % size holds sample number i. A round that starts late because the previous one overran is counted in telemetry_overruns_total.
+"""
+
+# reads per leg per second
+TELEMETRY_RATE = 50
+
+# samples kept per leg, 10 s at the default rate
+TELEMETRY_SIZE = 512
+
+TELEMETRY_DTYPE = np.dtype([
+    ("t", "f8"),
+    ("angle", "f4"),
+    ("done", "?"),
+    ("contact", "?"),
+    ("limit", "?"),
+    ("home_failed", "?"),
+    ("calibrated", "?"),
+    ("seq", "u1"),
+])
+
+
+class Telemetry:
+    def __init__(self, bus, rate=TELEMETRY_RATE, size=TELEMETRY_SIZE, devices=None):
+        """
+        bus - I2CBus using the framed protocol
+        rate - status reads per leg per second
+        size - samples kept per leg
+        devices - legs to read, defaults to every device on the bus
+        """
+
+        if not bus.framed:
+            raise ValueError("Telemetry needs the framed protocol (I2CBus framed=True)")
+
+        self.bus = bus
+        self.interval = 1.0 / rate
+        self.size = size
+        self.devices = list(bus.devices.values()) if devices is None else list(devices)
+
+        # address -> ring buffer and number of samples written to it
+        self.buffers = {device.address: np.zeros(size, dtype=TELEMETRY_DTYPE) for device in self.devices}
+        self.counts = {device.address: 0 for device in self.devices}
+
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.pollLoop, name="telemetry", daemon=True)
+        self.thread.start()
+
+        # I2CBus.pollPending reads from here from now on
+        self.bus.telemetry = self
+
+    def stop(self):
+        self.bus.telemetry = None
+        self.stop_event.set()
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def pollLoop(self):
+        next_round = time.monotonic()
+
+        while not self.stop_event.is_set():
+            self.pollOnce()
+
+            next_round += self.interval
+            now = time.monotonic()
+
+            if next_round < now:
+                # overran, start the next round now instead of bursting to catch up
+                METRICS.count("telemetry_overruns_total")
+                next_round = now
+
+            self.stop_event.wait(next_round - now)
+
+    def pollOnce(self):
+        # one status read of every leg
+        try:
+            with METRICS.time("telemetry_round"):
+                statuses = self.bus.readStatuses(self.devices)
+
+        except Exception as e:
+            LOG.error("telemetry_failed", error=str(e))
+            return
+
+        now = time.monotonic()
+
+        with self.lock:
+            for address, status in statuses.items():
+                row = self.buffers[address][self.counts[address] % self.size]
+                row["t"] = now
+                row["angle"] = status.angle
+                row["done"] = status.done
+                row["contact"] = status.contact
+                row["limit"] = status.limit
+                row["home_failed"] = status.home_failed
+                row["calibrated"] = status.calibrated
+                row["seq"] = status.seq
+
+                self.counts[address] += 1
+
+    def latest(self, address):
+        """Most recent sample of a leg (a copy), None before the first one"""
+
+        with self.lock:
+            count = self.counts[address]
+
+            if count == 0:
+                return None
+
+            return self.buffers[address][(count - 1) % self.size].copy()
+
+    def history(self, address, seconds=None):
+        """Samples of a leg oldest first (a copy), only the last seconds if given"""
+
+        with self.lock:
+            count = self.counts[address]
+            buffer = self.buffers[address]
+
+            if count <= self.size:
+                samples = buffer[:count].copy()
+            else:
+                # oldest sample sits right after the newest one
+                start = count % self.size
+                samples = np.concatenate((buffer[start:], buffer[:start]))
+
+        if seconds is not None and len(samples):
+            samples = samples[samples["t"] >= samples["t"][-1] - seconds]
+
+        return samples
+
+    def isFinished(self, address, seq):
+        """True if the latest sample shows the leg done with the frame numbered seq"""
+
+        sample = self.latest(address)
+        return sample is not None and bool(sample["done"]) and (seq is None or int(sample["seq"]) == seq)
+
+    def angles(self):
+        """{address: latest hip angle} for every leg with a sample"""
+
+        with self.lock:
+            return {address: float(self.buffers[address][(count - 1) % self.size]["angle"]) for address, count in self.counts.items() if count}
+
+    def close(self):
+        self.stop()